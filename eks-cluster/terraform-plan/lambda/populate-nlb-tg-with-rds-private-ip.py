@@ -2,6 +2,7 @@ import os
 import sys
 import boto3
 import logging
+import concurrent.futures
 
 from botocore.exceptions import ClientError
 
@@ -68,47 +69,54 @@ def deregister_target(tg_arn, new_target_list):
         logger.error(e.response['Error']['Message'])
 
 
-def target_group_list(ip_list):
+def target_group_list(targets):
 
-    target_list = []
-    for ip in ip_list:
-        target = {
-            'Id': ip,
-            'Port': RDS_PORT,
-        }
-        target_list.append(target)
-    return target_list
+    # The targets are (ip, port) pairs, sorted for stable requests and logs
+    return [{'Id': ip, 'Port': port} for ip, port in sorted(targets)]
 
 
-def get_registered_ips(tg_arn):
+def get_registered_targets(tg_arn):
+    """Return the state of each (ip, port) target of the target group, or None when they cannot be described.
+
+    DescribeTargetHealth is not paginated, it returns all the targets of the group,
+    the draining ones included, with their TargetHealth.State.
+    """
 
-    registered_ip_list = []
     try:
         response = elbv2client.describe_target_health(
             TargetGroupArn=tg_arn)
-        registered_ip_count = len(response['TargetHealthDescriptions'])
-        logger.info(f"INFO: Number of currently registered IP: {registered_ip_count}")
-        for target in response['TargetHealthDescriptions']:
-            registered_ip = target['Target']['Id']
-            registered_ip_list.append(registered_ip)
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
-    return registered_ip_list
+        return None
+
+    registered_targets = {
+        (target['Target']['Id'], target['Target']['Port']): target['TargetHealth']['State']
+        for target in response['TargetHealthDescriptions']
+    }
+    logger.info(f"INFO: Number of currently registered IP: {len(registered_targets)}")
+    return registered_targets
+
 
+def get_rds_private_ips():
+    """Return the private IPs of the network interfaces of the RDS security group, by availability zone.
 
-def get_rds_private_ips(rds_az):
+    The interfaces of all the zones are described, so that the lookup does not wait
+    for the current zone of the instance, or None when they cannot be described.
+    """
 
-    resp = ec2client.describe_network_interfaces(Filters=[{
-        'Name': 'group-id',
-        'Values': [RDS_SG_ID]
-    }, {
-        'Name': 'availability-zone',
-        'Values': [rds_az]
-    }])
-    private_ip_address = []
-    for interface in resp['NetworkInterfaces']:
-        private_ip_address.append(interface['PrivateIpAddress'])
-    return private_ip_address
+    private_ips = {}
+    try:
+        paginator = ec2client.get_paginator('describe_network_interfaces')
+        for page in paginator.paginate(Filters=[{
+            'Name': 'group-id',
+            'Values': [RDS_SG_ID]
+        }]):
+            for interface in page['NetworkInterfaces']:
+                private_ips.setdefault(interface['AvailabilityZone'], set()).add(interface['PrivateIpAddress'])
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'])
+        return None
+    return private_ips
 
 
 def get_rds_az():
@@ -116,12 +124,12 @@ def get_rds_az():
     logger.info(f"INFO: Get RDS current AZ: {RDS_ID}")
     az = None
     try:
-        response = rdsclient.describe_db_instances(
-            DBInstanceIdentifier=RDS_ID
-        )
-        if len(response['DBInstances']) > 0:
-            az = response['DBInstances'][0]['AvailabilityZone']
-            logger.info(f"INFO: RDS AZ is: {az}")
+        paginator = rdsclient.get_paginator('describe_db_instances')
+        for page in paginator.paginate(DBInstanceIdentifier=RDS_ID):
+            if page['DBInstances']:
+                az = page['DBInstances'][0]['AvailabilityZone']
+                logger.info(f"INFO: RDS AZ is: {az}")
+                break
 
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
@@ -129,30 +137,48 @@ def get_rds_az():
     return az
 
 
-def handler(event, context):
+def reconcile_targets(registered_targets, active_targets):
+    """Return the targets to register and to deregister, so that the target group holds the active targets only.
+
+    A draining target is on its way out of the group, so an active one is registered
+    again, while the other ones are left to the deregistration diff.
+    """
 
-    registered_ip_list = get_registered_ips(NLB_TG_ARN)
-    current_rds_az = get_rds_az()
-    new_active_ip_set = get_rds_private_ips(current_rds_az)
+    serving_targets = {target for target, state in registered_targets.items() if state != 'draining'}
+    return active_targets - serving_targets, set(registered_targets) - active_targets
 
-    registration_ip_list = []
-    # IPs that have not been registered
-    if len(registered_ip_list) == 0 or registered_ip_list != new_active_ip_set:
-        registration_ip_list = new_active_ip_set
 
-    if registration_ip_list:
-        registerTarget_list = target_group_list(registration_ip_list)
-        register_target(NLB_TG_ARN, registerTarget_list)
-        logger.info(f"INFO: Registering {registration_ip_list}")
+def handler(event, context):
+
+    # The lookups are independent, so they run concurrently, each client being thread-safe
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        registered_future = executor.submit(get_registered_targets, NLB_TG_ARN)
+        az_future = executor.submit(get_rds_az)
+        ips_future = executor.submit(get_rds_private_ips)
+        registered_targets = registered_future.result()
+        current_rds_az = az_future.result()
+        private_ips = ips_future.result()
+
+    if registered_targets is None or current_rds_az is None or private_ips is None:
+        logger.error("ERROR: The targets cannot be reconciled without the registered targets, the RDS AZ and its IPs")
+        return
+
+    active_targets = {(ip, RDS_PORT) for ip in private_ips.get(current_rds_az, set())}
+    if not active_targets:
+        # A failover in progress leaves the current targets in place rather than emptying the target group
+        logger.warning(f"WARNING: No RDS IP found in {current_rds_az}, the targets are left unchanged")
+        return
+
+    registration_targets, deregistration_targets = reconcile_targets(registered_targets, active_targets)
+
+    if registration_targets:
+        logger.info(f"INFO: Registering {sorted(registration_targets)}")
+        register_target(NLB_TG_ARN, target_group_list(registration_targets))
     else:
         logger.info(f"INFO: No new target registered")
 
-    deregistration_ip_list = []
-    if registered_ip_list != new_active_ip_set:
-        for ip in registered_ip_list:
-            deregistration_ip_list.append(ip)
-            logger.info(f"INFO: Deregistering IP: {ip}")
-            deregisterTarget_list = target_group_list(deregistration_ip_list)
-            deregister_target(NLB_TG_ARN, deregisterTarget_list)
+    if deregistration_targets:
+        logger.info(f"INFO: Deregistering {sorted(deregistration_targets)}")
+        deregister_target(NLB_TG_ARN, target_group_list(deregistration_targets))
     else:
         logger.info(f"INFO: No old target deregistered")
@@ -5,7 +5,9 @@ import os
 import sys
 import traceback
 
-import boto3
+# Imported before the third-party packages, to profile their imports on the cold starts
+import lambda_runtime
+
 import redshift_connector  # Test the import
 
 logger = logging.getLogger()
@@ -17,7 +19,7 @@ class S3Toolkit():
     def __init__(self):
 
         self.execution_date = datetime.datetime.now()
-        self.s3_session = boto3.session.Session().resource('s3')
+        self.s3_client = lambda_runtime.get_client('s3')
 
     def generate_data(self) -> dict:
         """Generate sample data to push to S3."""
@@ -37,14 +39,14 @@ class S3Toolkit():
             new_path.insert(-1, f'-{datetime.datetime.now()}.')
             file_path = ''.join(new_path)
 
-        object = self.s3_session.Object(bucket, file_path)
-        object.put(Body=file)
+        self.s3_client.put_object(Bucket=bucket, Key=file_path, Body=file)
 
         return
 
 
 def lambda_handler(event, context):
 
+    lambda_runtime.log_cold_start()
     logger.info("-------------------------------------------------------------------")
     logger.info(f"Lambda function ARN: {context.invoked_function_arn}")
     logger.info(f"CloudWatch log stream name: {context.log_stream_name}")
@@ -10,7 +10,8 @@ resource "aws_lambda_function" "lambda" {
 
   environment {
     variables = {
-      bucket_name = aws_s3_bucket.lambda_bucket.bucket
+      bucket_name     = aws_s3_bucket.lambda_bucket.bucket
+      profile_imports = var.profile_imports
     }
   }
   tags = {
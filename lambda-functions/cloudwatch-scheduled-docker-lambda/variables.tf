@@ -38,3 +38,8 @@ variable "timeout" {
   type        = string
   default     = 60
 }
+variable "profile_imports" {
+  description = "Whether to log the duration of the slowest imports on the cold starts"
+  type        = string
+  default     = "false"
+}
@@ -1,6 +1,7 @@
 import os
 import datetime
-import boto3
+
+import lambda_runtime
 
 
 class S3Toolkit():
@@ -8,7 +9,7 @@ class S3Toolkit():
     def __init__(self):
 
         self.execution_date = datetime.datetime.now()
-        self.s3_session = boto3.session.Session().resource('s3')
+        self.s3_client = lambda_runtime.get_client('s3')
 
     def generate_data(self) -> dict:
         """Generate sample data to push to S3."""
@@ -28,14 +29,14 @@ class S3Toolkit():
             new_path.insert(-1, f'-{datetime.datetime.now()}.')
             file_path = ''.join(new_path)
 
-        object = self.s3_session.Object(bucket, file_path)
-        object.put(Body=file)
+        self.s3_client.put_object(Bucket=bucket, Key=file_path, Body=file)
 
         return
 
 
 def lambda_handler(event, context):
 
+    lambda_runtime.log_cold_start()
     helper = S3Toolkit()
 
     bucket = os.environ.get('bucket_name')
@@ -2,8 +2,16 @@ provider "archive" {}
 
 data "archive_file" "zip" {
   type        = "zip"
-  source_file = "${path.module}/lambda/${var.function_name}.py"
   output_path = "${path.module}/lambda/${var.function_name}.zip"
+  source {
+    content  = file("${path.module}/lambda/${var.function_name}.py")
+    filename = "${var.function_name}.py"
+  }
+  # The runtime module shared by the Lambda functions
+  source {
+    content  = file("${path.module}/../shared/lambda_runtime.py")
+    filename = "lambda_runtime.py"
+  }
 }
 
 resource "aws_lambda_function" "lambda" {
@@ -14,12 +22,13 @@ resource "aws_lambda_function" "lambda" {
 
   role        = aws_iam_role.lambda.arn
   handler     = "${var.function_name}.lambda_handler"
-  runtime     = "python3.6"
+  runtime     = "python3.9"
   memory_size = var.memory_size
   timeout     = var.timeout
   environment {
     variables = {
-      bucket_name = var.bucket_name
+      bucket_name     = var.bucket_name
+      profile_imports = var.profile_imports
     }
   }
 }
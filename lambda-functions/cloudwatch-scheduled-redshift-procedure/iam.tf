@@ -64,7 +64,9 @@ data "aws_iam_policy_document" "policy_lambda_s3" {
       "s3:CopyObject",
       "s3:PutObject",
       "s3:PutObjectAcl",
-      "s3:HeadObject"
+      "s3:HeadObject",
+      "s3:DeleteObject",
+      "s3:AbortMultipartUpload"
     ]
     resources = [
       "${aws_s3_bucket.lambda_bucket.arn}/*"
@@ -115,6 +117,18 @@ data "aws_iam_policy_document" "policy_lambda_redshift" {
       "*"
     ]
   }
+  statement {
+    actions = [
+      "redshift-data:ExecuteStatement",
+      "redshift-data:BatchExecuteStatement",
+      "redshift-data:DescribeStatement",
+      "redshift-data:CancelStatement",
+      "redshift-serverless:GetCredentials"
+    ]
+    resources = [
+      "*"
+    ]
+  }
 }
 
 # Create IAM role for the lambda function
@@ -148,3 +162,51 @@ resource "aws_iam_role" "lambda" {
     Project     = var.project_name
   }
 }
+
+# Create the role allowing the Redshift cluster to UNLOAD to and COPY from the bucket, to associate with the cluster
+data "aws_iam_policy_document" "policy_redshift_execution" {
+  statement {
+    effect = "Allow"
+
+    principals {
+      identifiers = ["redshift.amazonaws.com"]
+      type        = "Service"
+    }
+    actions = ["sts:AssumeRole"]
+  }
+}
+data "aws_iam_policy_document" "policy_redshift_s3" {
+  statement {
+    actions = [
+      "s3:ListBucket",
+      "s3:GetBucketLocation"
+    ]
+    resources = [
+      aws_s3_bucket.lambda_bucket.arn
+    ]
+  }
+  statement {
+    actions = [
+      "s3:PutObject",
+      "s3:GetObject",
+      "s3:DeleteObject"
+    ]
+    resources = [
+      "${aws_s3_bucket.lambda_bucket.arn}/*"
+    ]
+  }
+}
+resource "aws_iam_role" "redshift" {
+  name               = "${var.project_name}-${var.function_name}-redshift-${var.env_name}"
+  assume_role_policy = data.aws_iam_policy_document.policy_redshift_execution.json
+
+  inline_policy {
+    name   = "policy-redshift-s3"
+    policy = data.aws_iam_policy_document.policy_redshift_s3.json
+  }
+  tags = {
+    Name        = "${var.project_name}-${var.function_name}-redshift-${var.env_name}"
+    Environment = var.env_name
+    Project     = var.project_name
+  }
+}
@@ -60,6 +60,10 @@ aws ecr set-repository-policy \
     --region $REGION
 
 
+# Copy the runtime module shared by the Lambda functions into the build context
+SCRIPT_PATH=$(cd "$(dirname "$0")" && pwd)
+cp "$SCRIPT_PATH/../../shared/lambda_runtime.py" ./lambda_runtime.py
+
 # Build and push the image to ECR
 REPOSITORY_URI=$AWS_ACCOUNT_ID.dkr.ecr.$REGION.amazonaws.com/$REPOSITORY_NAME
 IMAGE_NAME=$REPOSITORY_NAME
@@ -76,3 +80,5 @@ else
 fi
 
 docker push $REPOSITORY_URI --all-tags
+
+rm ./lambda_runtime.py
@@ -1,18 +1,621 @@
+import atexit
 import base64
+import csv
 import datetime
+import gzip
+import io
 import json
 import logging
 import os
+import re
+import signal
+import string
 import sys
+import time
 import traceback
+import uuid
+
+# Imported before the third-party packages, to profile their imports on the cold starts
+import lambda_runtime
 
-import boto3
-import redshift_connector
 from botocore.exceptions import ClientError
 
+# The connector is only loaded when connecting to Redshift
+redshift_connector = lambda_runtime.lazy_import('redshift_connector')
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+SECRET_TTL = 300
+SECRET_VERSION_STAGE = 'AWSCURRENT'
+COMPRESSION_LEVEL = 6
+FETCH_SIZE = 10000
+EXPORT_CURSOR = 'export_cursor'
+EXPORT_FORMATS = {'ndjson': 'json.gz', 'csv': 'csv.gz'}
+EXPORT_MODES = ['stream', 'unload']
+UNLOAD_FORMATS = ['parquet', 'csv', 'json']
+UNLOAD_MAX_FILE_SIZE_MB = 256
+IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_$]*$')
+COPY_THRESHOLD = 10000
+COPY_FILE_ROWS = 100000
+INSERT_BATCH_ROWS = 1000
+# The number of parameters of a statement is a 16-bit integer of the PostgreSQL protocol
+MAX_PARAMETERS = 32767
+STAGING_PREFIX = 'staging/'
+POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 5
+TIME_BUDGET_MARGIN_MS = 10000
+STATEMENT_DONE_STATUSES = ['FINISHED', 'FAILED', 'ABORTED']
+WATERMARK_PREFIX = 'watermarks/'
+
+
+class SecretCache():
+    """Cache of the Secrets Manager secrets, shared by the warm invocations.
+
+    A cached secret is used as is until its TTL expires. It is then checked with
+    DescribeSecret, and only fetched again when another version holds its stage,
+    e.g. after a rotation. It can also be refreshed on demand, when the credentials
+    it holds are rejected.
+    """
+    def __init__(self, ttl: int = SECRET_TTL, version_stage: str = SECRET_VERSION_STAGE):
+        self.ttl = ttl
+        self.version_stage = version_stage
+        self.secrets = dict()
+
+    def get_secret(self, secret_id: str, region_name: str = None, refresh: bool = False):
+        """Return the value of a secret, from the cache while it is fresh.
+
+        Args:
+            secret_id: The ARN or name of the secret.
+            region_name: The AWS region of the secret. Defaults to None, the region of the function.
+            refresh: Whether to fetch the secret again, even if it is fresh. Defaults to False.
+
+        Returns:
+            The string, or the decoded binary, value of the secret.
+        """
+        client = lambda_runtime.get_client('secretsmanager', region_name=region_name)
+        cached = self.secrets.get(secret_id)
+
+        if cached is not None and not refresh:
+            if time.monotonic() < cached['expires_at']:
+                return cached['secret']
+            # The version holding the stage only changes on rotation
+            versions = client.describe_secret(SecretId=secret_id).get('VersionIdsToStages', {})
+            if self.version_stage in versions.get(cached['version_id'], []):
+                cached['expires_at'] = time.monotonic() + self.ttl
+                return cached['secret']
+
+        response = client.get_secret_value(SecretId=secret_id, VersionStage=self.version_stage)
+        # Decrypts secret using the associated KMS key
+        if 'SecretString' in response:
+            secret = response['SecretString']
+        else:
+            secret = base64.b64decode(response['SecretBinary'])
+        logger.info(f"Fetched the version {response['VersionId']} of the secret {secret_id}.")
+
+        self.secrets[secret_id] = {
+            'secret': secret,
+            'version_id': response['VersionId'],
+            'expires_at': time.monotonic() + self.ttl
+        }
+        return secret
+
+
+secret_cache = SecretCache(int(os.environ.get('secret_ttl', SECRET_TTL)))
+
+
+class RedshiftConnectionManager():
+    """Redshift connection kept open by the execution environment for its warm invocations.
+
+    The connection is checked with a lightweight query before being reused, and opened
+    again when it was dropped, e.g. after an idle timeout or a failover of the cluster,
+    or when the credentials changed.
+    """
+    def __init__(self):
+        self.connection = None
+        self.params = None
+
+    def get_connection(self, params: dict) -> 'redshift_connector.Connection':
+        """Return the open connection, or connect to Redshift.
+
+        Args:
+            params: The host, port, database, username and password of the Redshift cluster.
+
+        Raises:
+            redshift_connector.InterfaceError: The connection failed.
+
+        Returns:
+            The connection, in autocommit mode.
+        """
+        if self.connection is not None and params == self.params and self.is_healthy():
+            return self.connection
+
+        self.close()
+        connection = redshift_connector.connect(
+            host=params['host'],
+            port=int(params['port']),
+            database=params['database'],
+            user=params['username'],
+            password=params['password']
+        )
+        connection.rollback()
+        connection.autocommit = True
+        self.connection, self.params = connection, dict(params)
+        return connection
+
+    def is_healthy(self) -> bool:
+        """Whether the connection still answers queries."""
+        cursor = None
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            return True
+        # Any failure of the probe means a new connection, whatever the driver raises
+        except Exception:
+            logger.warning("The Redshift connection was dropped, reconnecting.")
+            return False
+        finally:
+            # Closed, so that the probes of the warm invocations don't pile up cursors on the connection
+            if cursor is not None:
+                cursor.close()
+
+    def close(self) -> None:
+        """Close the connection, releasing its session on the cluster."""
+        if self.connection is None:
+            return
+        try:
+            self.connection.close()
+        except (redshift_connector.Error, OSError):
+            pass
+        finally:
+            self.connection, self.params = None, None
+
+
+class RedshiftUnloader():
+    """Export the results of queries to S3 with UNLOAD, written by the slices of the cluster.
+
+    The rows go from the cluster to S3 without going through the Lambda function,
+    which only runs the statement and checks the manifest of the written files, so
+    that the export time scales with the slices of the cluster.
+    """
+    def __init__(
+        self,
+        cursor,
+        s3_client,
+        iam_role: str,
+        output_format: str = 'parquet',
+        partition_by: list = None,
+        parallel: bool = True,
+        max_file_size: int = UNLOAD_MAX_FILE_SIZE_MB
+    ):
+        """Configure the UNLOAD statements.
+
+        Args:
+            cursor: The Redshift cursor running the statements.
+            s3_client: The S3 client reading the manifests.
+            iam_role: The ARN of the IAM role associated with the cluster, allowed to write to the bucket.
+            output_format: Either 'parquet', 'csv' or 'json', the last two being gzipped. Defaults to 'parquet'.
+            partition_by: The columns partitioning the files in Hive-style folders. Defaults to None.
+            parallel: Whether each slice writes its own files, or a single writer is used. Defaults to True.
+            max_file_size: The maximum size in MB of the written files, from 5 to 6200.
+                Defaults to UNLOAD_MAX_FILE_SIZE_MB.
+
+        Raises:
+            ValueError: The format or a partition column is not valid.
+        """
+        if output_format not in UNLOAD_FORMATS:
+            raise ValueError(f"The UNLOAD format should be one of {UNLOAD_FORMATS}, not {output_format}.")
+        for column in partition_by or []:
+            if not IDENTIFIER_PATTERN.match(column):
+                raise ValueError(f"The partition column {column} is not a valid column name.")
+
+        self.cursor = cursor
+        self.s3_client = s3_client
+        self.iam_role = iam_role
+        self.output_format = output_format
+        self.partition_by = partition_by or []
+        self.parallel = parallel
+        self.max_file_size = max_file_size
+
+    def get_unload_query(self, query: str, bucket: str, prefix: str) -> str:
+        """Return the UNLOAD statement exporting the results of a query under a S3 prefix."""
+        # The quotes of the literals of the query are escaped by doubling them
+        escaped_query = query.replace("'", "''")
+        options = [f'FORMAT AS {self.output_format.upper()}']
+        if self.partition_by:
+            options.append(f"PARTITION BY ({', '.join(self.partition_by)})")
+        if self.output_format == 'csv':
+            options.append('HEADER')
+        if self.output_format != 'parquet':
+            options.append('GZIP')
+        options.extend([
+            f"PARALLEL {'ON' if self.parallel else 'OFF'}",
+            f'MAXFILESIZE {self.max_file_size} MB',
+            'MANIFEST VERBOSE'
+        ])
+        return '\n'.join([
+            f"UNLOAD ('{escaped_query}')",
+            f"TO 's3://{bucket}/{prefix}'",
+            f"IAM_ROLE '{self.iam_role}'",
+            *options
+        ])
+
+    def read_manifest(self, bucket: str, prefix: str) -> dict:
+        """Return the files written by an UNLOAD statement, with their number of rows and size."""
+        response = self.s3_client.get_object(Bucket=bucket, Key=f'{prefix}manifest')
+        manifest = json.loads(response['Body'].read())
+        entries = manifest.get('entries', [])
+        return {
+            'files': len(entries),
+            'rows': sum(entry['meta']['record_count'] for entry in entries),
+            'bytes': sum(entry['meta']['content_length'] for entry in entries)
+        }
+
+    def unload(self, query: str, bucket: str, prefix: str) -> dict:
+        """Export the results of a query under a S3 prefix, and check the written files.
+
+        Args:
+            query: The SELECT statement.
+            bucket: The S3 bucket where to write the files.
+            prefix: The S3 prefix of the files, ending with a slash to write them in a folder.
+
+        Returns:
+            The number of files written, of rows and of bytes, from the manifest.
+        """
+        self.cursor.execute(self.get_unload_query(query, bucket, prefix))
+        result = self.read_manifest(bucket, prefix)
+        logger.info(f"Unloaded {result['rows']} rows in {result['files']} files to s3://{bucket}/{prefix}.")
+        return result
+
+
+class BulkLoader():
+    """Load rows into Redshift tables, with a strategy depending on their number.
+
+    The small batches are inserted with multi-row INSERT statements, and the large
+    ones are staged to S3 as gzipped NDJSON files, loaded in parallel by the slices
+    of the cluster with COPY. Redshift is very slow with single-row INSERT statements.
+    """
+    def __init__(
+        self,
+        cursor,
+        s3_client,
+        bucket: str,
+        iam_role: str = None,
+        copy_threshold: int = COPY_THRESHOLD,
+        staging_prefix: str = STAGING_PREFIX
+    ):
+        """Configure the loads.
+
+        Args:
+            cursor: The Redshift cursor running the statements.
+            s3_client: The S3 client staging the files loaded with COPY.
+            bucket: The S3 bucket where to stage the files.
+            iam_role: The ARN of the IAM role associated with the cluster, allowed to read the bucket.
+                Defaults to None, the rows being always inserted.
+            copy_threshold: The number of rows from which they are loaded with COPY. Defaults to COPY_THRESHOLD.
+            staging_prefix: The S3 prefix of the staged files. Defaults to STAGING_PREFIX.
+        """
+        self.cursor = cursor
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.iam_role = iam_role
+        self.copy_threshold = copy_threshold
+        self.staging_prefix = staging_prefix
+
+    def check_identifiers(self, table: str, columns: list) -> None:
+        """Check the names of the table, optionally qualified by its schema, and of the columns.
+
+        Raises:
+            ValueError: A name is not a valid identifier, or there is no column.
+        """
+        if not columns:
+            raise ValueError(f"The rows loaded into {table} should have at least one column.")
+        for identifier in table.split('.') + list(columns):
+            if not IDENTIFIER_PATTERN.match(identifier):
+                raise ValueError(f"{identifier} is not a valid table or column name.")
+
+    def load(self, table: str, columns: list, rows: list) -> dict:
+        """Load rows into a table.
+
+        Args:
+            table: The name of the table, optionally qualified by its schema.
+            columns: The names of the loaded columns.
+            rows: The rows, as sequences of values in the order of the columns.
+
+        Returns:
+            The strategy used, the number of rows loaded, the duration in seconds and
+            the number of rows loaded per second.
+        """
+        self.check_identifiers(table, columns)
+
+        start = time.perf_counter()
+        if self.iam_role and len(rows) >= self.copy_threshold:
+            strategy = 'copy'
+            self.copy_rows(table, columns, rows)
+        else:
+            strategy = 'insert'
+            self.insert_rows(table, columns, rows)
+        seconds = time.perf_counter() - start
+
+        result = {
+            'strategy': strategy,
+            'rows': len(rows),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(len(rows) / seconds, 1) if seconds else None
+        }
+        logger.info(f'Loaded {table}: {json.dumps(result)}')
+        return result
+
+    def insert_rows(self, table: str, columns: list, rows: list) -> None:
+        """Insert rows with multi-row INSERT statements, their values being bound parameters."""
+        batch_size = max(1, min(INSERT_BATCH_ROWS, MAX_PARAMETERS // len(columns)))
+        row_placeholder = f"({', '.join(['%s'] * len(columns))})"
+        for index in range(0, len(rows), batch_size):
+            batch = rows[index:index + batch_size]
+            self.cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_placeholder] * len(batch))}",
+                [value for row in batch for value in row]
+            )
+
+    def copy_rows(self, table: str, columns: list, rows: list) -> None:
+        """Stage rows to S3 as gzipped NDJSON files and load them with COPY."""
+        prefix = f'{self.staging_prefix}{table}/{uuid.uuid4()}/'
+        keys = list()
+        try:
+            # Several files are loaded in parallel by the slices of the cluster
+            for index in range(0, len(rows), COPY_FILE_ROWS):
+                lines = (json.dumps(dict(zip(columns, row)), default=str) for row in rows[index:index + COPY_FILE_ROWS])
+                body = gzip.compress('\n'.join(lines).encode('utf-8'), compresslevel=COMPRESSION_LEVEL)
+                keys.append(f'{prefix}part-{len(keys):05d}.json.gz')
+                self.s3_client.put_object(Bucket=self.bucket, Key=keys[-1], Body=body)
+
+            self.cursor.execute('\n'.join([
+                f"COPY {table} ({', '.join(columns)})",
+                f"FROM 's3://{self.bucket}/{prefix}'",
+                f"IAM_ROLE '{self.iam_role}'",
+                # The keys are matched with the column names, which Redshift lowercases
+                "FORMAT AS JSON 'auto ignorecase'",
+                'GZIP',
+                "DATEFORMAT 'auto'",
+                "TIMEFORMAT 'auto'"
+            ]))
+        finally:
+            for index in range(0, len(keys), 1000):
+                self.s3_client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={'Objects': [{'Key': key} for key in keys[index:index + 1000]], 'Quiet': True}
+                )
+
+
+class WatermarkStore():
+    """Persist the high-water marks of the incremental exports of the tables in S3.
+
+    The state of each table is a JSON object holding the watermark column, the greatest
+    value of this column already exported and the metadata signature of the table. It is
+    written with a conditional request on the ETag read before the export, so that two
+    overlapping runs cannot both advance the mark of a table.
+    """
+    def __init__(self, s3_client, bucket: str, prefix: str = WATERMARK_PREFIX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get_key(self, table: str) -> str:
+        return f'{self.prefix}{table}.json'
+
+    def get(self, table: str) -> tuple:
+        """Return the state of a table and its ETag, or an empty state and None before its first export."""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.get_key(table))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                return dict(), None
+            raise e
+        return json.loads(response['Body'].read()), response['ETag']
+
+    def put(self, table: str, state: dict, etag: str = None) -> str:
+        """Replace the state of a table, if it was not changed since it was read.
+
+        Args:
+            table: The name of the table.
+            state: The new state of the table.
+            etag: The ETag of the state read before the export, None if there was none.
+
+        Raises:
+            ClientError: The state was changed or created by another run, with the PreconditionFailed code.
+
+        Returns:
+            The ETag of the new state.
+        """
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        response = self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.get_key(table),
+            Body=json.dumps(state).encode(),
+            ContentType='application/json',
+            **condition
+        )
+        return response['ETag']
+
+
+class ProcedureRunner():
+    """Run a DAG of SQL statements and stored procedures with the Redshift Data API.
+
+    The statements of the steps are submitted asynchronously as soon as the steps
+    they depend on succeeded, so that the independent steps overlap on the cluster.
+    Their status is then polled with an exponential backoff, without holding a
+    connection open while the queries run.
+
+    Each step has a unique name and either a sql statement, a list of sql statements
+    run in a single transaction, or a procedure called with its parameters, e.g.
+    {"name": "refresh", "procedure": "refresh_sales", "parameters": {"day": "${execution_date}"},
+    "depends_on": ["load"]}. The ${...} variables of the statements and parameters are
+    replaced by their values.
+    """
+    def __init__(
+        self,
+        client,
+        database: str,
+        cluster_identifier: str = None,
+        workgroup_name: str = None,
+        secret_arn: str = None,
+        variables: dict = None,
+        poll_interval: float = POLL_INTERVAL,
+        max_poll_interval: float = MAX_POLL_INTERVAL
+    ):
+        """Configure the target of the statements.
+
+        Args:
+            client: The Redshift Data API client.
+            database: The name of the database.
+            cluster_identifier: The identifier of a provisioned cluster. Defaults to None.
+            workgroup_name: The name of a Redshift Serverless workgroup, instead of a cluster. Defaults to None.
+            secret_arn: The ARN of the secret holding the username and password. Defaults to None.
+            variables: The values of the ${...} variables of the steps. Defaults to None.
+            poll_interval: The initial interval in seconds between the status checks. Defaults to POLL_INTERVAL.
+            max_poll_interval: The maximum interval in seconds between the status checks.
+                Defaults to MAX_POLL_INTERVAL.
+        """
+        self.client = client
+        self.target = {'Database': database}
+        if workgroup_name:
+            self.target['WorkgroupName'] = workgroup_name
+        else:
+            self.target['ClusterIdentifier'] = cluster_identifier
+        if secret_arn:
+            self.target['SecretArn'] = secret_arn
+        self.variables = variables or {}
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    def sort_steps(self, steps: list) -> list:
+        """Return the steps in a topological order of their dependencies.
+
+        Raises:
+            ValueError: A step is duplicated, depends on an unknown step, or the steps hold a cycle.
+        """
+        names = [step['name'] for step in steps]
+        if len(set(names)) != len(names):
+            raise ValueError("The names of the steps should be unique.")
+        for step in steps:
+            for dependency in step.get('depends_on', []):
+                if dependency not in names:
+                    raise ValueError(f"The step {step['name']} depends on the unknown step {dependency}.")
+
+        sorted_steps, sorted_names = list(), set()
+        while len(sorted_steps) < len(steps):
+            ready = [
+                step for step in steps
+                if step['name'] not in sorted_names and set(step.get('depends_on', [])) <= sorted_names
+            ]
+            if not ready:
+                raise ValueError("The dependencies of the steps hold a cycle.")
+            sorted_steps.extend(ready)
+            sorted_names.update(step['name'] for step in ready)
+        return sorted_steps
+
+    def substitute(self, text: str) -> str:
+        """Replace the ${...} variables of a statement or parameter."""
+        return string.Template(str(text)).safe_substitute(self.variables)
+
+    def submit(self, step: dict) -> str:
+        """Submit the statements of a step, and return the identifier of the submission."""
+        parameters = [
+            {'name': name, 'value': self.substitute(value)}
+            for name, value in step.get('parameters', {}).items()
+        ]
+        if 'procedure' in step:
+            arguments = ', '.join(f":{parameter['name']}" for parameter in parameters)
+            sql = f"CALL {step['procedure']}({arguments})"
+        else:
+            sql = step['sql']
+
+        if isinstance(sql, list):
+            response = self.client.batch_execute_statement(
+                Sqls=[self.substitute(statement) for statement in sql], StatementName=step['name'], **self.target
+            )
+        elif parameters:
+            response = self.client.execute_statement(
+                Sql=self.substitute(sql), Parameters=parameters, StatementName=step['name'], **self.target
+            )
+        else:
+            response = self.client.execute_statement(Sql=self.substitute(sql), StatementName=step['name'], **self.target)
+        logger.info(f"Submitted the step {step['name']} as the statement {response['Id']}.")
+        return response['Id']
+
+    def run(self, steps: list, deadline: float = None) -> dict:
+        """Run the steps, each one as soon as the steps it depends on succeeded.
+
+        The steps depending on a failed step are skipped. When the deadline is reached,
+        the function returns without waiting for the running statements, which go on
+        on the cluster.
+
+        Args:
+            steps: The steps of the DAG.
+            deadline: The time.monotonic() value when to stop polling. Defaults to None.
+
+        Returns:
+            The status of each step, FINISHED, FAILED, ABORTED or SKIPPED once done,
+            with the identifier and duration in seconds of its statement.
+        """
+        sorted_steps = self.sort_steps(steps)
+        results = {step['name']: {'status': 'PENDING'} for step in sorted_steps}
+        running = dict()
+        interval = self.poll_interval
+
+        while True:
+            # The steps are sorted, so that the skipped steps cascade in a single pass
+            for step in sorted_steps:
+                result = results[step['name']]
+                if result['status'] != 'PENDING':
+                    continue
+                dependencies = [results[dependency]['status'] for dependency in step.get('depends_on', [])]
+                if any(status in ('FAILED', 'ABORTED', 'SKIPPED') for status in dependencies):
+                    result['status'] = 'SKIPPED'
+                elif all(status == 'FINISHED' for status in dependencies):
+                    result['id'] = running[step['name']] = self.submit(step)
+                    result['status'] = 'SUBMITTED'
+
+            if not running:
+                break
+            if deadline is not None and time.monotonic() + interval > deadline:
+                logger.warning(f"Stopped polling the running steps {list(running)} before the timeout.")
+                break
+
+            time.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+            for name, statement_id in list(running.items()):
+                description = self.client.describe_statement(Id=statement_id)
+                results[name]['status'] = description['Status']
+                if description['Status'] not in STATEMENT_DONE_STATUSES:
+                    continue
+                del running[name]
+                # The next steps are submitted and checked sooner
+                interval = self.poll_interval
+                results[name]['seconds'] = round(description.get('Duration', 0) / 1e9, 3)
+                if description['Status'] != 'FINISHED':
+                    logger.error(f"The step {name} is {description['Status']}: {description.get('Error')}")
+
+        logger.info(f'Procedure steps: {json.dumps(results)}')
+        return results
+
+
+connection_manager = RedshiftConnectionManager()
+atexit.register(connection_manager.close)
+
+
+def handle_sigterm(signum, frame) -> None:
+    """Close the Redshift connection when Lambda shuts the execution environment down.
+
+    The runtime is left to exit on its own, since raising SystemExit from the
+    handler would interrupt whatever the main thread is running.
+    """
+    connection_manager.close()
+
+
+signal.signal(signal.SIGTERM, handle_sigterm)
+
 
 class RedshiftPermissions:
 
@@ -21,19 +624,22 @@ class RedshiftPermissions:
         self.aws_region = os.environ['aws_region']
         self.secret_arn = os.environ['secrets_config_arn']
         __redshift_config = json.loads(self.__get_config(self.secret_arn, self.aws_region))
-        self.cursor = self.__connect_to_redshift(__redshift_config)
+        try:
+            self.cursor = self.__connect_to_redshift(__redshift_config)
+        except ValueError:
+            # The cached credentials may predate a rotation of the secret
+            logger.warning("The Redshift authentication failed, refreshing the cached credentials.")
+            __redshift_config = json.loads(self.__get_config(self.secret_arn, self.aws_region, refresh=True))
+            self.cursor = self.__connect_to_redshift(__redshift_config)
+        self.connection = connection_manager.connection
 
-    def __get_config(self, secret_arn: str, region_name: str) -> None:
+    def __get_config(self, secret_arn: str, region_name: str, refresh: bool = False) -> str:
         """Retrieves the AWS Redshift credentials from AWS Secret Manager. The returned secret should
-        include the host, port, database, user and password."""
-
-        # Create a Secrets Manager client
-        session = boto3.session.Session()
-        client = session.client(service_name='secretsmanager',
-                                region_name=region_name)
+        include the host, port, database, user and password. The secret is cached by the warm invocations
+        until its TTL expires or it is rotated, or refreshed when refresh is True."""
 
         try:
-            get_secret_value_response = client.get_secret_value(SecretId=secret_arn)
+            secret = secret_cache.get_secret(secret_arn, region_name, refresh)
 
         except ClientError as e:
             # Log potential errors
@@ -56,17 +662,9 @@ class RedshiftPermissions:
                 raise e
 
         else:
-            # Decrypts secret using the associated KMS key
-            if 'SecretString' in get_secret_value_response:
-                secret = get_secret_value_response['SecretString']
-            else:
-                secret = base64.b64decode(get_secret_value_response['SecretBinary'])
-
-            logger.info(f"Secret : {secret}")
-
             return secret
 
-    def __connect_to_redshift(self, params: dict) -> redshift_connector.Cursor:
+    def __connect_to_redshift(self, params: dict) -> 'redshift_connector.Cursor':
         """Connects to the redshift instance used as storage backend for the extraction with redshift - connector.
         For more information about this library, see https://pypi.org/project/redshift-connector/.
 
@@ -78,22 +676,21 @@ class RedshiftPermissions:
         """
 
         try:
-            con = redshift_connector.connect(
-                host=params['host'],
-                port=int(params['port']),
-                database=params['database'],
-                user=params['username'],
-                password=params['password']
-            )
-
-            con.rollback()
-            con.autocommit = True
+            # The connection is reused by the warm invocations
+            con = connection_manager.get_connection(params)
             cursor = con.cursor()
             return cursor
 
         except redshift_connector.InterfaceError:
             raise ValueError("The Redshift authentication configuration used is incorrect.")
 
+    def close(self) -> None:
+        """Close the cursor of the invocation, the connection being kept open for the next ones."""
+        try:
+            self.cursor.close()
+        except (redshift_connector.Error, OSError):
+            pass
+
     def create_redshift_table(self):
         """Create a table in the Redshift instance."""
         logger.info('Creating the phonebook table')
@@ -101,12 +698,18 @@ class RedshiftPermissions:
         self.cursor.execute(query)
         return
 
-    def insert_redshift_data(self):
-        """Create a table in the Redshift instance."""
-        logger.info('Inserting a record into the table')
-        query = """INSERT INTO phonebook(phone, firstname, lastname, address) VALUES('+1 123 456 7890', 'John', 'Doe', 'North America');"""
-        self.cursor.execute(query)
-        return
+    def insert_redshift_data(self, rows: list = None) -> dict:
+        """Load records into the phonebook table, a sample one by default."""
+        logger.info('Inserting records into the table')
+        rows = rows or [('+1 123 456 7890', 'John', 'Doe', 'North America')]
+        loader = BulkLoader(
+            self.cursor,
+            lambda_runtime.get_client('s3'),
+            os.environ.get('bucket_name'),
+            os.environ.get('redshift_iam_role'),
+            int(os.environ.get('copy_threshold', COPY_THRESHOLD))
+        )
+        return loader.load('phonebook', ['phone', 'firstname', 'lastname', 'address'], rows)
 
     def delete_redshift_table(self):
         """Delete the created table from Redshift."""
@@ -115,28 +718,256 @@ class RedshiftPermissions:
         self.cursor.execute(query)
         return
 
-    def write_s3_file(self, bucket: str, file_path: str, replace=False) -> None:
-        """Write the cleaned file to s3."""
+    def iter_rows(self, query: str, fetch_size: int = FETCH_SIZE):
+        """Run a query and yield its rows by batches, from a server-side cursor.
+
+        redshift_connector holds the whole result set of a statement in memory, so
+        the rows are fetched from a cursor declared on the cluster instead, at most
+        fetch_size rows being held at once. The cursor requires a transaction.
+
+        Args:
+            query: The SELECT statement.
+            fetch_size: The number of rows fetched at once. Defaults to FETCH_SIZE.
+
+        Yields:
+            The column names, and the next batch of rows, the first batch being yielded
+            even when the query returns no row.
+        """
+        self.connection.autocommit = False
+        try:
+            self.cursor.execute(f'DECLARE {EXPORT_CURSOR} CURSOR FOR {query}')
+            first_batch = True
+            while True:
+                self.cursor.execute(f'FETCH FORWARD {fetch_size} FROM {EXPORT_CURSOR}')
+                rows = self.cursor.fetchmany(fetch_size)
+                if not rows and not first_batch:
+                    break
+                yield [column[0] for column in self.cursor.description], rows
+                if not rows:
+                    break
+                first_batch = False
+            self.cursor.execute(f'CLOSE {EXPORT_CURSOR}')
+            self.connection.commit()
+        except BaseException:
+            self.connection.rollback()
+            raise
+        finally:
+            self.connection.autocommit = True
+
+    def export_query(
+        self,
+        query: str,
+        bucket: str,
+        file_path: str,
+        output_format: str = 'ndjson',
+        fetch_size: int = FETCH_SIZE
+    ) -> int:
+        """Stream the results of a query to a gzipped NDJSON or CSV file in S3.
+
+        The rows are compressed and uploaded as they are fetched, so that the memory
+        used is bounded by the fetch size and the size of the uploaded parts.
+
+        Args:
+            query: The SELECT statement.
+            bucket: The S3 bucket where to write the file.
+            file_path: The path of the file to be written in S3.
+            output_format: Either 'ndjson', one JSON object per line, or 'csv' with a header.
+                Defaults to 'ndjson'.
+            fetch_size: The number of rows fetched at once. Defaults to FETCH_SIZE.
+
+        Returns:
+            The number of exported rows.
+        """
+        if output_format not in EXPORT_FORMATS:
+            raise ValueError(f"The export format should be one of {list(EXPORT_FORMATS)}, not {output_format}.")
+
+        exported = 0
+        s3_client = lambda_runtime.get_client('s3')
+        with lambda_runtime.S3MultipartWriter(s3_client, bucket, file_path) as writer, \
+                gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=COMPRESSION_LEVEL) as gzipfile:
+            text = io.TextIOWrapper(gzipfile, encoding='utf-8', newline='')
+            csv_writer = csv.writer(text) if output_format == 'csv' else None
+
+            header = csv_writer is not None
+            for columns, rows in self.iter_rows(query, fetch_size):
+                if csv_writer is not None:
+                    # The header is written from the columns of the first batch, whatever the row count
+                    if header:
+                        csv_writer.writerow(columns)
+                        header = False
+                    csv_writer.writerows(rows)
+                else:
+                    # Dates and decimals are written as strings
+                    text.writelines(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows)
+                exported += len(rows)
+
+            text.flush()
+            text.detach()
+
+        logger.info(f'Exported {exported} rows to s3://{bucket}/{file_path}.')
+        return exported
+
+    def get_table_signature(self, table: str) -> list:
+        """Return the metadata of a table changing with its rows, None when it is not known.
+
+        The number of rows of SVV_TABLE_INFO includes the rows marked as deleted until the
+        table is vacuumed, so that it grows with each insert and update, and its size changes
+        when the blocks of the table are rewritten. The empty tables are not listed.
+
+        Args:
+            table: The name of the table, optionally qualified by its schema, the current schema by default.
+        """
+        schema, _, name = table.rpartition('.')
+        if not schema:
+            # current_schema() runs on the leader node only, so it can't be joined with the system view
+            self.cursor.execute('SELECT current_schema()')
+            schema = self.cursor.fetchone()[0]
+        self.cursor.execute(
+            'SELECT tbl_rows, size FROM svv_table_info WHERE "schema" = %s AND "table" = %s', (schema, name)
+        )
+        rows = self.cursor.fetchall()
+        # Without a single match, the table is exported rather than compared with the metadata of another one
+        if len(rows) != 1:
+            return None
+        return [int(value) for value in rows[0]]
+
+    def export_incremental(
+        self,
+        table: str,
+        column: str,
+        bucket: str,
+        file_path: str,
+        output_format: str = 'ndjson',
+        fetch_size: int = FETCH_SIZE
+    ) -> int:
+        """Export the rows of a table added since its previous export, past its high-water mark.
+
+        The query is skipped when the metadata of the table did not change since the
+        previous run. Otherwise, the rows up to the current greatest value of the watermark
+        column are exported, and the mark is then advanced to this value, only once the
+        file was written. The column should only grow, e.g. a creation timestamp or an
+        identity column.
+
+        Args:
+            table: The name of the table, optionally qualified by its schema.
+            column: The watermark column of the table.
+            bucket: The S3 bucket where to write the file and the watermarks.
+            file_path: The path of the file to be written in S3.
+            output_format: Either 'ndjson' or 'csv'. Defaults to 'ndjson'.
+            fetch_size: The number of rows fetched at once. Defaults to FETCH_SIZE.
+
+        Raises:
+            ValueError: The table or the column is not a valid name.
+            ClientError: The watermark was advanced by another run, with the PreconditionFailed code.
+
+        Returns:
+            The number of exported rows.
+        """
+        for identifier in table.split('.') + [column]:
+            if not IDENTIFIER_PATTERN.match(identifier):
+                raise ValueError(f"{identifier} is not a valid table or column name.")
+
+        watermarks = WatermarkStore(lambda_runtime.get_client('s3'), bucket)
+        state, etag = watermarks.get(table)
+        if state.get('column') != column:
+            # The watermark of another column does not apply, the table is exported from the start
+            state = {'column': column}
+
+        signature = self.get_table_signature(table)
+        if signature is not None and signature == state.get('signature'):
+            logger.info(f"The table {table} did not change since its export up to {column} = {state.get('watermark')}.")
+            return 0
+
+        # The marks are compared as string literals, cast by Redshift to the type of the column
+        condition = ''
+        if state.get('watermark') is not None:
+            escaped_watermark = state['watermark'].replace("'", "''")
+            condition = f"WHERE {column} > '{escaped_watermark}'"
+        self.cursor.execute(f'SELECT MAX({column}) FROM {table} {condition}')
+        watermark = self.cursor.fetchone()[0]
+
+        exported = 0
+        if watermark is not None:
+            watermark = str(watermark)
+            escaped_watermark = watermark.replace("'", "''")
+            condition = f"{condition} AND" if condition else 'WHERE'
+            query = f"SELECT * FROM {table} {condition} {column} <= '{escaped_watermark}'"
+            exported = self.export_query(query, bucket, file_path, output_format, fetch_size)
+        else:
+            logger.info(f"No rows of the table {table} past {column} = {state.get('watermark')}.")
+
+        watermarks.put(table, {
+            'column': column,
+            'watermark': watermark if watermark is not None else state.get('watermark'),
+            'signature': signature,
+            'exported_rows': exported,
+            'exported_at': datetime.datetime.now().isoformat()
+        }, etag)
+        return exported
+
+    def unload_s3_files(self, bucket: str, prefix: str) -> dict:
+        """Unload the phonebook table to s3, with the settings of the environment variables."""
+
+        logger.info('Unloading the phonebook table')
+        query = "SELECT * FROM phonebook"
+        partition_by = os.environ.get('unload_partition_by', '')
+        unloader = RedshiftUnloader(
+            self.cursor,
+            lambda_runtime.get_client('s3'),
+            os.environ['redshift_iam_role'],
+            output_format=os.environ.get('unload_format', 'parquet'),
+            partition_by=[column.strip() for column in partition_by.split(',') if column.strip()],
+            parallel=os.environ.get('unload_parallel', 'true') == 'true',
+            max_file_size=int(os.environ.get('unload_max_file_size', UNLOAD_MAX_FILE_SIZE_MB))
+        )
+        return unloader.unload(query, bucket, prefix)
+
+    def write_s3_file(self, bucket: str, file_path: str, replace=False, output_format: str = 'ndjson') -> int:
+        """Write the phonebook table to s3, as a gzipped NDJSON or CSV file."""
 
         logger.info('Querying the phonebook table')
         query = "SELECT * FROM phonebook"
-        data = self.cursor.execute(query).fetch_dataframe()
-        file = json.dumps(data.to_dict()).encode('utf-8')
-        logger.info(f'Writing the following json to S3: {data.to_dict()}')
 
         if replace == False:
-            new_path = file_path.split('.')
-            new_path.insert(-1, f'-{datetime.datetime.now()}.')
-            file_path = ''.join(new_path)
+            name, _, extension = file_path.partition('.')
+            file_path = f'{name}-{datetime.datetime.now()}.{extension}'
 
-        client = boto3.session.Session().client('s3')
-        client.put_object(Bucket=bucket, Body=file, Key=file_path)
+        return self.export_query(query, bucket, file_path, output_format, int(os.environ.get('fetch_size', FETCH_SIZE)))
+
+    def write_incremental_s3_file(self, bucket: str, file_path: str, column: str, output_format: str = 'ndjson') -> int:
+        """Write the rows of the phonebook table past its high-water mark to s3, as a gzipped NDJSON or CSV file."""
+
+        logger.info(f'Querying the phonebook table past its {column} watermark')
+        name, _, extension = file_path.partition('.')
+        file_path = f'{name}-{datetime.datetime.now()}.{extension}'
+
+        return self.export_incremental(
+            'phonebook', column, bucket, file_path, output_format, int(os.environ.get('fetch_size', FETCH_SIZE))
+        )
 
-        return
+
+def run_procedure_dag(dag: dict, context) -> dict:
+    """Run a DAG of SQL steps with the Redshift Data API, within the invocation time."""
+    redshift_config = json.loads(secret_cache.get_secret(os.environ['secrets_config_arn'], os.environ['aws_region']))
+    runner = ProcedureRunner(
+        lambda_runtime.get_client('redshift-data', region_name=os.environ['aws_region']),
+        redshift_config['database'],
+        cluster_identifier=os.environ.get('cluster_identifier'),
+        workgroup_name=os.environ.get('workgroup_name'),
+        secret_arn=os.environ['secrets_config_arn'],
+        variables={
+            'bucket_name': os.environ.get('bucket_name'),
+            'redshift_iam_role': os.environ.get('redshift_iam_role'),
+            'execution_date': datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        }
+    )
+    deadline = time.monotonic() + (context.get_remaining_time_in_millis() - TIME_BUDGET_MARGIN_MS) / 1000
+    return runner.run(dag['steps'], deadline)
 
 
 def lambda_handler(event, context):
 
+    lambda_runtime.log_cold_start()
     logger.info("-------------------------------------------------------------------")
     logger.info(f"Lambda function ARN: {context.invoked_function_arn}")
     logger.info(f"CloudWatch log stream name: {context.log_stream_name}")
@@ -145,16 +976,37 @@ def lambda_handler(event, context):
     logger.info(f"Lambda function memory limits in MB: {context.memory_limit_in_mb}")
     logger.info(f'S3 event notification: {event}')
 
+    module = None
     try:
 
+        # The DAG of SQL steps comes from the event, e.g. the input of a scheduled rule, or from a file of the image
+        if event.get('steps') or os.environ.get('dag_config'):
+            if event.get('steps'):
+                dag = event
+            else:
+                with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.environ['dag_config'])) as fh:
+                    dag = json.load(fh)
+            return run_procedure_dag(dag, context)
+
         module = RedshiftPermissions()
         execution_date = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
         bucket = os.environ.get('bucket_name')
-        file_path = f'test_{execution_date}.json'
+        export_mode = os.environ.get('export_mode', 'stream')
+        export_format = os.environ.get('export_format', 'ndjson')
+        watermark_column = os.environ.get('watermark_column')
+        if export_mode not in EXPORT_MODES:
+            raise ValueError(f"The export mode should be one of {EXPORT_MODES}, not {export_mode}.")
 
         module.create_redshift_table()
         module.insert_redshift_data()
-        module.write_s3_file(bucket, file_path)
+        if export_mode == 'unload':
+            module.unload_s3_files(bucket, f'test_{execution_date}/')
+        elif watermark_column:
+            file_path = f'test_{execution_date}.{EXPORT_FORMATS.get(export_format, "json.gz")}'
+            module.write_incremental_s3_file(bucket, file_path, watermark_column, output_format=export_format)
+        else:
+            file_path = f'test_{execution_date}.{EXPORT_FORMATS.get(export_format, "json.gz")}'
+            module.write_s3_file(bucket, file_path, output_format=export_format)
         module.delete_redshift_table()
 
     except Exception:
@@ -167,4 +1019,8 @@ def lambda_handler(event, context):
         })
         logger.error(err_msg)
 
+    finally:
+        if module is not None:
+            module.close()
+
     return
@@ -13,9 +13,24 @@ resource "aws_lambda_function" "lambda" {
   ]
   environment {
     variables = {
-      bucket_name        = aws_s3_bucket.lambda_bucket.bucket
-      aws_region         = var.aws_region
-      secrets_config_arn = aws_secretsmanager_secret.redshift_config.arn
+      bucket_name          = aws_s3_bucket.lambda_bucket.bucket
+      aws_region           = var.aws_region
+      secrets_config_arn   = aws_secretsmanager_secret.redshift_config.arn
+      profile_imports      = var.profile_imports
+      secret_ttl           = var.secret_ttl
+      export_format        = var.export_format
+      fetch_size           = var.fetch_size
+      export_mode          = var.export_mode
+      redshift_iam_role    = aws_iam_role.redshift.arn
+      copy_threshold       = var.copy_threshold
+      unload_format        = var.unload_format
+      unload_partition_by  = var.unload_partition_by
+      unload_parallel      = var.unload_parallel
+      unload_max_file_size = var.unload_max_file_size
+      cluster_identifier   = var.cluster_identifier
+      workgroup_name       = var.workgroup_name
+      dag_config           = var.dag_config
+      watermark_column     = var.watermark_column
     }
   }
   tags = {
@@ -0,0 +1,114 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_PATH, '..', 'lambda'))
+sys.path.insert(0, os.path.join(SCRIPTS_PATH, '..', '..', 'shared'))
+
+DAG_CONFIG = os.path.join(SCRIPTS_PATH, '..', 'lambda', 'procedure-dag.json')
+
+
+class FakeRedshiftDataClient():
+    """In-process stand-in for the subset of the boto3 Redshift Data API client used by the Lambda function.
+
+    The statements do not run anywhere: each one is FINISHED once its duration has
+    elapsed, or FAILED when its name matches a failing pattern, so that the scheduling
+    of a DAG can be checked and measured locally without a cluster nor AWS credentials.
+    """
+    def __init__(self, durations: dict = None, default_duration: float = 1.0, failures: str = None):
+        self.durations = durations or {}
+        self.default_duration = default_duration
+        self.failures = re.compile(failures) if failures else None
+        self.statements = dict()
+        self.statement_ids = itertools.count()
+        self.describe_calls = 0
+        self.lock = threading.Lock()
+
+    def submit(self, name: str, sqls: list, **kwargs) -> dict:
+        """Store a statement started now."""
+        statement_id = f'statement-{next(self.statement_ids)}'
+        with self.lock:
+            self.statements[statement_id] = {
+                'Id': statement_id,
+                'StatementName': name,
+                'QueryString': '; '.join(sqls),
+                'Start': time.monotonic(),
+                'Duration': self.durations.get(name, self.default_duration),
+                'Failed': bool(self.failures and self.failures.search(name or ''))
+            }
+        return {'Id': statement_id, 'Database': kwargs.get('Database')}
+
+    def execute_statement(self, Sql: str, StatementName: str = None, **kwargs) -> dict:
+        return self.submit(StatementName, [Sql], **kwargs)
+
+    def batch_execute_statement(self, Sqls: list, StatementName: str = None, **kwargs) -> dict:
+        return self.submit(StatementName, Sqls, **kwargs)
+
+    def describe_statement(self, Id: str) -> dict:
+        with self.lock:
+            self.describe_calls += 1
+            statement = self.statements[Id]
+        elapsed = time.monotonic() - statement['Start']
+        response = {'Id': Id, 'QueryString': statement['QueryString'], 'Duration': -1}
+        if elapsed < statement['Duration']:
+            response['Status'] = 'STARTED'
+        elif statement['Failed']:
+            response.update({'Status': 'FAILED', 'Error': f"ERROR: simulated failure of {statement['StatementName']}"})
+        else:
+            response.update({'Status': 'FINISHED', 'Duration': int(statement['Duration'] * 1e9)})
+        return response
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Run a DAG of SQL steps with the procedure runner against an in-memory Redshift Data API.'
+    )
+    parser.add_argument('--dag', default=DAG_CONFIG, help='JSON file of the DAG.')
+    parser.add_argument('--duration', type=float, default=1.0, help='Duration in seconds of each statement.')
+    parser.add_argument(
+        '--durations', type=json.loads, default={}, help='JSON object of the durations of some steps, by name.'
+    )
+    parser.add_argument('--fail', help='Regular expression of the names of the failing steps.')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='Initial interval between status checks.')
+    parser.add_argument('--max-poll-interval', type=float, default=1.0, help='Maximum interval between status checks.')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_arguments()
+
+    import lambda_function
+
+    with open(args.dag) as fh:
+        steps = json.load(fh)['steps']
+
+    client = FakeRedshiftDataClient(args.durations, args.duration, args.fail)
+    runner = lambda_function.ProcedureRunner(
+        client,
+        'test_database',
+        cluster_identifier='local',
+        variables={'bucket_name': 'bucket', 'redshift_iam_role': 'role', 'execution_date': 'local'},
+        poll_interval=args.poll_interval,
+        max_poll_interval=args.max_poll_interval
+    )
+    start = time.perf_counter()
+    results = runner.run(steps)
+    seconds = time.perf_counter() - start
+
+    sequential = sum(args.durations.get(step['name'], args.duration) for step in steps)
+    print(json.dumps({
+        'steps': {name: result['status'] for name, result in results.items()},
+        'describe_calls': client.describe_calls,
+        'seconds': round(seconds, 3),
+        'sequential_seconds': round(sequential, 3)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import importlib.util
+import io
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', 'scripts'))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', '..', 'shared'))
+
+
+class FakeCursor():
+    """Stand-in for a redshift_connector cursor, recording the statements and returning queued rows."""
+    def __init__(self, results: list = None):
+        self.statements = list()
+        self.results = list(results or [])
+        self.rows = list()
+
+    def execute(self, sql: str, args=None) -> 'FakeCursor':
+        self.statements.append((sql, args))
+        self.rows = list(self.results.pop(0)) if self.results else []
+        return self
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self) -> list:
+        rows, self.rows = self.rows, []
+        return rows
+
+
+class FakeS3Client():
+    """Stand-in for the subset of the boto3 S3 client used by the function, with conditional writes."""
+    def __init__(self):
+        self.objects = dict()
+        self.versions = 0
+
+    def error(self, code: str, status_code: int, operation: str) -> ClientError:
+        return ClientError(
+            {'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status_code}},
+            operation
+        )
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        if (Bucket, Key) not in self.objects:
+            raise self.error('NoSuchKey', 404, 'GetObject')
+        body, etag = self.objects[(Bucket, Key)]
+        return {'Body': io.BytesIO(body), 'ETag': etag}
+
+    def put_object(self, Bucket: str, Key: str, Body, IfMatch: str = None, IfNoneMatch: str = None, **kwargs) -> dict:
+        current = self.objects.get((Bucket, Key))
+        if IfNoneMatch == '*' and current is not None or IfMatch is not None and (current or (None, None))[1] != IfMatch:
+            raise self.error('PreconditionFailed', 412, 'PutObject')
+        self.versions += 1
+        etag = f'"{self.versions}"'
+        self.objects[(Bucket, Key)] = (Body.read() if hasattr(Body, 'read') else Body, etag)
+        return {'ETag': etag}
+
+    def delete_objects(self, Bucket: str, Delete: dict, **kwargs) -> dict:
+        for obj in Delete['Objects']:
+            self.objects.pop((Bucket, obj['Key']), None)
+        return {'Deleted': Delete['Objects']}
+
+
+@pytest.fixture(scope='session')
+def lambda_function():
+    """The module of the function, loaded under its own name since the other functions have a lambda_function too."""
+    path = os.path.join(TESTS_PATH, '..', 'lambda', 'lambda_function.py')
+    spec = importlib.util.spec_from_file_location('redshift_procedure_lambda_function', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def cursor() -> FakeCursor:
+    return FakeCursor()
+
+
+@pytest.fixture
+def s3_client() -> FakeS3Client:
+    return FakeS3Client()
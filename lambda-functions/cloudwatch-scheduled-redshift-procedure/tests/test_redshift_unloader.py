@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+IAM_ROLE = 'arn:aws:iam::000000000000:role/redshift-unload'
+
+
+def test_unload_query_parquet(lambda_function, cursor, s3_client):
+    unloader = lambda_function.RedshiftUnloader(cursor, s3_client, IAM_ROLE)
+
+    assert unloader.get_unload_query('SELECT * FROM phonebook', 'bucket', 'export/').split('\n') == [
+        "UNLOAD ('SELECT * FROM phonebook')",
+        "TO 's3://bucket/export/'",
+        f"IAM_ROLE '{IAM_ROLE}'",
+        'FORMAT AS PARQUET',
+        'PARALLEL ON',
+        'MAXFILESIZE 256 MB',
+        'MANIFEST VERBOSE',
+    ]
+
+
+@pytest.mark.parametrize('output_format, options', [
+    ('csv', ['FORMAT AS CSV', 'HEADER', 'GZIP']),
+    ('json', ['FORMAT AS JSON', 'GZIP']),
+])
+def test_unload_query_gzipped_formats(lambda_function, cursor, s3_client, output_format, options):
+    unloader = lambda_function.RedshiftUnloader(cursor, s3_client, IAM_ROLE, output_format=output_format)
+
+    lines = unloader.get_unload_query('SELECT 1', 'bucket', 'export/').split('\n')
+
+    assert lines[3:-3] == options
+
+
+def test_unload_query_options(lambda_function, cursor, s3_client):
+    unloader = lambda_function.RedshiftUnloader(
+        cursor, s3_client, IAM_ROLE, partition_by=['lastname', 'firstname'], parallel=False, max_file_size=64
+    )
+
+    lines = unloader.get_unload_query('SELECT 1', 'bucket', 'export/').split('\n')
+
+    assert lines[3:] == [
+        'FORMAT AS PARQUET',
+        'PARTITION BY (lastname, firstname)',
+        'PARALLEL OFF',
+        'MAXFILESIZE 64 MB',
+        'MANIFEST VERBOSE',
+    ]
+
+
+def test_unload_query_escapes_quotes(lambda_function, cursor, s3_client):
+    unloader = lambda_function.RedshiftUnloader(cursor, s3_client, IAM_ROLE)
+
+    query = unloader.get_unload_query("SELECT * FROM phonebook WHERE lastname = 'O''Brien'", 'bucket', 'export/')
+
+    assert query.split('\n')[0] == "UNLOAD ('SELECT * FROM phonebook WHERE lastname = ''O''''Brien''')"
+
+
+@pytest.mark.parametrize('kwargs', [{'output_format': 'avro'}, {'partition_by': ['lastname; DROP TABLE phonebook']}])
+def test_unloader_rejects_invalid_options(lambda_function, cursor, s3_client, kwargs):
+    with pytest.raises(ValueError):
+        lambda_function.RedshiftUnloader(cursor, s3_client, IAM_ROLE, **kwargs)
+
+
+def test_unload_reads_the_manifest(lambda_function, cursor, s3_client):
+    s3_client.put_object(Bucket='bucket', Key='export/manifest', Body=json.dumps({'entries': [
+        {'url': 's3://bucket/export/0000_part_00.parquet', 'meta': {'record_count': 3, 'content_length': 100}},
+        {'url': 's3://bucket/export/0001_part_00.parquet', 'meta': {'record_count': 2, 'content_length': 50}},
+    ]}).encode())
+    unloader = lambda_function.RedshiftUnloader(cursor, s3_client, IAM_ROLE)
+
+    result = unloader.unload('SELECT * FROM phonebook', 'bucket', 'export/')
+
+    assert result == {'files': 2, 'rows': 5, 'bytes': 150}
+    assert cursor.statements[0][0].startswith("UNLOAD ('SELECT * FROM phonebook')")
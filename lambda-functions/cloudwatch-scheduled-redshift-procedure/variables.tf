@@ -42,3 +42,73 @@ variable "timeout" {
   type        = string
   default     = 120
 }
+variable "profile_imports" {
+  description = "Whether to log the duration of the slowest imports on the cold starts"
+  type        = string
+  default     = "false"
+}
+variable "secret_ttl" {
+  description = "The time in seconds the Redshift credentials are cached by the warm invocations before checking for a rotation"
+  type        = string
+  default     = "300"
+}
+variable "export_format" {
+  description = "The format of the exported files, either ndjson or csv, gzipped"
+  type        = string
+  default     = "ndjson"
+}
+variable "fetch_size" {
+  description = "The number of rows fetched at once from Redshift when exporting a query"
+  type        = string
+  default     = "10000"
+}
+variable "export_mode" {
+  description = "How the table is exported: stream, through the Lambda function, or unload, written to S3 by the cluster"
+  type        = string
+  default     = "stream"
+}
+variable "unload_format" {
+  description = "The format of the files written by UNLOAD, either parquet, csv or json"
+  type        = string
+  default     = "parquet"
+}
+variable "unload_partition_by" {
+  description = "The comma-separated columns partitioning the files written by UNLOAD, none by default"
+  type        = string
+  default     = ""
+}
+variable "unload_parallel" {
+  description = "Whether each slice of the cluster writes its own files with UNLOAD"
+  type        = string
+  default     = "true"
+}
+variable "unload_max_file_size" {
+  description = "The maximum size in MB of the files written by UNLOAD, from 5 to 6200"
+  type        = string
+  default     = "256"
+}
+variable "copy_threshold" {
+  description = "The number of rows from which they are loaded with COPY from S3 instead of multi-row INSERT statements"
+  type        = string
+  default     = "10000"
+}
+variable "cluster_identifier" {
+  description = "The identifier of the Redshift cluster running the steps of the DAG with the Data API"
+  type        = string
+  default     = ""
+}
+variable "workgroup_name" {
+  description = "The Redshift Serverless workgroup running the steps of the DAG with the Data API, instead of a cluster"
+  type        = string
+  default     = ""
+}
+variable "dag_config" {
+  description = "The JSON file of the image holding the DAG of SQL steps to run with the Data API, e.g. procedure-dag.json, none by default"
+  type        = string
+  default     = ""
+}
+variable "watermark_column" {
+  description = "The growing column of the table from which only the new rows are exported, past its high-water mark, a full export by default"
+  type        = string
+  default     = ""
+}
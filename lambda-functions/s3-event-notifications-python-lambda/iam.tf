@@ -42,7 +42,9 @@ data "aws_iam_policy_document" "policy_lambda_s3" {
       "s3:CopyObject",
       "s3:PutObject",
       "s3:PutObjectAcl",
-      "s3:HeadObject"
+      "s3:HeadObject",
+      "s3:DeleteObject",
+      "s3:AbortMultipartUpload"
     ]
     resources = [
       "${aws_s3_bucket.mobile.arn}/*",
@@ -50,6 +52,18 @@ data "aws_iam_policy_document" "policy_lambda_s3" {
     ]
   }
 }
+# Create the policy allowing the lambda to consume the S3 event notifications queue
+data "aws_iam_policy_document" "policy_lambda_sqs" {
+  count = var.sqs_batching ? 1 : 0
+  statement {
+    actions = [
+      "sqs:ReceiveMessage",
+      "sqs:DeleteMessage",
+      "sqs:GetQueueAttributes"
+    ]
+    resources = [aws_sqs_queue.notifications[0].arn]
+  }
+}
 # Create IAM role for the lambda function
 resource "aws_iam_role" "lambda" {
   name               = var.function_name
@@ -63,6 +77,13 @@ resource "aws_iam_role" "lambda" {
     name   = "policy-lambda-s3"
     policy = data.aws_iam_policy_document.policy_lambda_s3.json
   }
+  dynamic "inline_policy" {
+    for_each = data.aws_iam_policy_document.policy_lambda_sqs
+    content {
+      name   = "policy-lambda-sqs"
+      policy = inline_policy.value.json
+    }
+  }
   tags = {
     Name        = "${var.namespace}-${var.function_name}-role-${var.environment}"
     Environment = var.environment
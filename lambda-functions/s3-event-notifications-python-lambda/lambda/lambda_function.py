@@ -1,44 +1,1353 @@
+import collections
+import concurrent.futures
+import contextlib
 import datetime
 import gzip
+import hashlib
 import io
 import json
 import logging
+import multiprocessing
+import os
+import queue
 import re
+import struct
 import sys
+import threading
 import traceback
+import urllib.parse
+import zlib
 
-import boto3
+# Imported before the third-party packages, to profile their imports on the cold starts
+import lambda_runtime
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+# The Parquet output mode requires pyarrow, e.g. from the AWS SDK for pandas layer,
+# which is only imported when a Parquet file is written
+pyarrow = lambda_runtime.lazy_import('pyarrow', 'parquet')
+
+try:
+    import orjson
+except ImportError:
+    # The orjson JSON backend is optional, the standard library being used without it
+    orjson = None
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+PII_FIELDS = ['ip', 'account', 'parent_account']
+WORKER_MEMORY_MB = 32
+WORKERS_PER_CPU = 4
+MAX_RETRIES = 10
+RETRY_BUDGET_MS = 5000
+TIME_BUDGET_MARGIN_MS = 10000
+TIME_BUDGET_CHECK_LINES = 10000
+COMPRESSION_LEVEL = 6
+GZIP_BLOCK_SIZE = 1024 * 1024
+GZIP_MEMBER_SIZE_ID = b'SZ'
+DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_CONCURRENCY = 4
+DOWNLOAD_READ_SIZE = 256 * 1024
+OUTPUT_FORMATS = ['json', 'parquet']
+PARQUET_ROW_GROUP_SIZE = 10000
+PARQUET_EXTRA_COLUMN = '_extra'
+PLAN_CACHE_SIZE = 1024
+CONTAINER_TYPES = {dict, list}
+PLAN_KEY_TYPES = {str, type(None)}
+JSON_BACKENDS = ['auto', 'json', 'orjson']
+LAMBDA_MB_PER_VCPU = 1769
+REDACTION_CHUNK_MIN_SIZE = 1024 * 1024
+REDACTION_CHUNK_MAX_SIZE = 16 * 1024 * 1024
+# A chunk is held raw and redacted by both the function and a worker process
+REDACTION_CHUNK_COPIES = 4
+# Compressed size from which a file is redacted by the pool of processes, the smaller
+# ones being redacted faster by their thread than sent to the processes
+REDACTION_POOL_MIN_SIZE = 8 * 1024 * 1024
+# Bump when the redaction changes, so that the files processed before are processed again
+REDACTION_VERSION = 1
+SOURCE_ETAG_METADATA = 'source-etag'
+REDACTION_CONFIG_METADATA = 'redaction-config'
+AUDIT_MAX_PATHS = 1000
+AUDIT_OTHER_PATH = '<other>'
+TRANSIENT_ERROR_CODES = [
+    'SlowDown', 'ServiceUnavailable', 'InternalError', 'RequestTimeout', 'RequestTimeoutException',
+    'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException'
+]
+
+
+class TimeBudgetExceeded(Exception):
+    """The Lambda invocation has not enough time left to complete the processing."""
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether an error is caused by throttling, a timeout or a server-side failure,
+    so that the processing can succeed when retried later.
+
+    Args:
+        error: The error raised while processing a file.
+
+    Returns:
+        Whether the error is transient.
+    """
+    if isinstance(error, (TimeBudgetExceeded, ConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        error_code = error.response.get('Error', {}).get('Code')
+        status_code = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+        return error_code in TRANSIENT_ERROR_CODES or status_code in (500, 502, 503, 504)
+    return False
+
+
+def get_pool_size(memory_limit_in_mb: int, worker_memory_mb: int = WORKER_MEMORY_MB) -> int:
+    """Return the number of files to process concurrently in a Lambda invocation.
+
+    The files are processed by threads since the work is mostly bound by S3 I/O.
+    Their number is capped by the memory each streamed file needs and by the vCPUs
+    Lambda allocates in proportion of the memory.
+
+    Args:
+        memory_limit_in_mb: The Lambda function memory limits in MB.
+        worker_memory_mb: The memory in MB needed to stream a file. Defaults to WORKER_MEMORY_MB.
+
+    Returns:
+        The size of the thread pool.
+    """
+    workers_by_memory = int(memory_limit_in_mb) // worker_memory_mb
+    workers_by_cpu = (os.cpu_count() or 1) * WORKERS_PER_CPU
+    return max(1, min(workers_by_memory, workers_by_cpu))
+
+
+def get_redaction_pool_size(memory_limit_in_mb: int) -> int:
+    """Return the number of processes redacting the chunks of a file in parallel.
+
+    Lambda allocates a vCPU per 1769 MB of memory, up to 6 vCPUs at 10240 MB.
+
+    Args:
+        memory_limit_in_mb: The Lambda function memory limits in MB.
+
+    Returns:
+        The number of redaction processes, 1 meaning the file is redacted by the function itself.
+    """
+    return max(1, min(os.cpu_count() or 1, int(memory_limit_in_mb) // LAMBDA_MB_PER_VCPU))
+
+
+def get_redaction_chunk_size(memory_limit_in_mb: int, workers: int, files: int = 1) -> int:
+    """Return the size in bytes of the chunks of a file redacted by the worker processes.
+
+    The chunks in flight hold at most a quarter of the memory, leaving the rest
+    to the download, the compression and the upload of the files, and the quarter
+    is shared by the files processed at once.
+
+    Args:
+        memory_limit_in_mb: The Lambda function memory limits in MB.
+        workers: The number of redaction processes.
+        files: The number of files processed at once. Defaults to 1.
+
+    Returns:
+        The size of the chunks, between REDACTION_CHUNK_MIN_SIZE and REDACTION_CHUNK_MAX_SIZE.
+    """
+    chunk_size = int(memory_limit_in_mb) * 2**20 // (4 * REDACTION_CHUNK_COPIES * max(1, workers) * max(1, files))
+    return max(REDACTION_CHUNK_MIN_SIZE, min(REDACTION_CHUNK_MAX_SIZE, chunk_size))
+
+
+def count_containers(object) -> int:
+    """Count the objects and arrays of a JSON document, itself included."""
+    count = 0
+    stack = [object]
+    while stack:
+        object = stack.pop()
+        if type(object) == dict:
+            count += 1
+            stack.extend(object.values())
+        elif type(object) == list:
+            count += 1
+            stack.extend(object)
+    return count
+
+
+class JSONSerializer():
+    """Parse and serialize JSON documents from and to UTF-8 bytes with the standard library.
+
+    The documents are serialized without whitespace and with their non-ASCII
+    characters as they are, as orjson does.
+    """
+    name = 'json'
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+    def dumps(self, object) -> bytes:
+        return json.dumps(object, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonSerializer(JSONSerializer):
+    """Parse and serialize JSON documents from and to UTF-8 bytes with orjson.
+
+    The documents that orjson rejects, with NaN or infinite numbers, fall back to
+    the standard library, these numbers being written as null. orjson parses the
+    integers beyond 64 bits as floats, which Segment sources can't send anyway as
+    they follow the JavaScript number precision.
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("The orjson JSON backend requires the orjson package.")
+
+    def loads(self, data: bytes):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+
+    def dumps(self, object) -> bytes:
+        try:
+            return orjson.dumps(object)
+        except orjson.JSONEncodeError:
+            return super().dumps(object)
+
+
+def get_serializer(json_backend: str = 'auto') -> JSONSerializer:
+    """Return the JSON serializer of a backend, orjson being used by 'auto' when it is installed.
+
+    Args:
+        json_backend: The JSON backend, among JSON_BACKENDS. Defaults to 'auto'.
+
+    Returns:
+        The JSON serializer.
+    """
+    if json_backend not in JSON_BACKENDS:
+        raise ValueError(f"The JSON backend should be one of {JSON_BACKENDS}, not {json_backend}.")
+    if json_backend == 'orjson' or (json_backend == 'auto' and orjson is not None):
+        return OrjsonSerializer()
+    return JSONSerializer()
+
+
+class PIIRedactor():
+    """Replace the values of the PII keys of a JSON document with None.
+
+    The key patterns are compiled once into a single case-insensitive regex and
+    the match decision is memoized per distinct key name, so that the few hundred
+    keys repeated across a Segment dump are only evaluated once. The same patterns
+    are compiled for raw bytes, to leave untouched the lines that cannot hold PIIs
+    without parsing them.
+
+    Events sharing a Segment type and event name share the same structure, so the
+    paths of their PII keys are learned from the first event walked and cached as a
+    redaction plan. The following raw lines of that type are only checked to have
+    the keys of the plan, in the same order, and no other object or array than
+    the ones of the plan, which their count of brackets bounds, or which are
+    counted in the parsed event when some brackets are in strings. The values at
+    the paths of the plan are then replaced, and the event is walked entirely when
+    it has another shape, the plan being learned again.
+    """
+    def __init__(self, pii_keys: list[str] = PII_FIELDS, serializer: JSONSerializer = None):
+        """Compile the PII key patterns.
+
+        Args:
+            pii_keys: The key substrings whose values should be replaced.
+            serializer: The JSON serializer of the raw lines. Defaults to the standard library one.
+        """
+        self.serializer = serializer or JSONSerializer()
+        self.pii_keys = sorted(set(pii_keys))
+        self.pattern = re.compile('|'.join(re.escape(key) for key in self.pii_keys), re.IGNORECASE)
+        self.line_pattern = re.compile(b'|'.join(re.escape(key.encode()) for key in self.pii_keys), re.IGNORECASE)
+        self.key_matches = dict()
+        self.plans = dict()
+        # The redactor is shared by the threads of the files, which evict and add plans concurrently
+        self.plans_lock = threading.Lock()
+
+    def is_pii_key(self, key: str) -> bool:
+        """Whether a key name contains one of the PII key patterns."""
+        try:
+            return self.key_matches[key]
+        except KeyError:
+            match = self.key_matches[key] = self.pattern.search(key) is not None
+            return match
+
+    def may_hold_pii(self, line: bytes) -> bool:
+        """Whether a raw JSON line may hold a PII key, and should be parsed.
+
+        The lines with escaped characters are parsed whatever their bytes, since a
+        key such as "\\u0069p" only reads ip once decoded.
+        """
+        return self.line_pattern.search(line) is not None or b'\\u' in line
+
+    def redact(self, object: dict) -> dict:
+        """Replace the values of the PII keys with None in a single walk of the document.
+
+        Args:
+            object: The JSON object to be processed, either an event or a list of events.
+
+        Returns:
+            The processed JSON object.
+        """
+        for event in object if type(object) == list else [object]:
+            self.redact_values(event)
+        return object
+
+    def get_plan_key(self, event: dict) -> tuple:
+        """Return the Segment type and event name of an event, or None when it has none."""
+        if type(event) != dict:
+            return None
+        event_type, event_name = event.get('type'), event.get('event')
+        if type(event_type) not in PLAN_KEY_TYPES or type(event_name) not in PLAN_KEY_TYPES:
+            return None
+        return event_type, event_name
+
+    def redact_values(self, event: dict, containers: int = None) -> int:
+        """Replace the values of the PII keys of an event with None and count the replaced values.
+
+        Args:
+            event: The JSON object to be processed.
+            containers: The maximum number of objects and arrays of the event, known from
+                its raw line. The event is walked entirely when it is not given. Defaults to None.
+
+        Returns:
+            The number of replaced values.
+        """
+        plan_key = self.get_plan_key(event) if containers is not None else None
+        if plan_key is None:
+            return self.walk(event, learn=False)[0]
+
+        plan = self.plans.get(plan_key)
+        if plan is not None:
+            redacted = self.apply_plan(event, plan, containers)
+            if redacted is not None:
+                return redacted
+
+        redacted, plan = self.walk(event)
+        if plan is not None:
+            with self.plans_lock:
+                if plan_key not in self.plans and len(self.plans) >= PLAN_CACHE_SIZE:
+                    self.plans.pop(next(iter(self.plans)))
+                self.plans[plan_key] = plan
+        return redacted
+
+    def apply_plan(self, event: dict, plan: tuple, containers: int) -> int:
+        """Replace the values of the PII keys at the paths of a redaction plan.
+
+        The plan applies when the objects of the event have the keys of the plan and
+        the event holds no other object or array than the ones of the plan, that is
+        as many as the brackets of its raw line, or, when its strings hold brackets
+        too, as many as the ones left in the event. The values replaced before another
+        shape is found are PII values as well, which the full walk following the
+        failed plan replaces anyway.
+
+        Args:
+            event: The JSON object to be processed.
+            plan: The redaction plan learned for the type of the event.
+            containers: The maximum number of objects and arrays of the event.
+
+        Returns:
+            The number of replaced values, or None when the event has another shape.
+        """
+        redacted = 0
+        nodes = 0
+        stack = [(event, plan)]
+        while stack:
+            object, node = stack.pop()
+            containers -= 1
+            nodes += 1
+            if node[0] == 'dict':
+                if type(object) != dict or tuple(object) != node[1]:
+                    return None
+                for key in node[2]:
+                    if type(object[key]) in CONTAINER_TYPES:
+                        containers -= count_containers(object[key])
+                    object[key] = None
+                redacted += len(node[2])
+                for key, child in node[3]:
+                    stack.append((object[key], child))
+            else:
+                if type(object) != list:
+                    return None
+                elements = node[1]
+                for element in object:
+                    if type(element) == dict:
+                        child = elements.get(tuple(element))
+                        if child is None:
+                            return None
+                        stack.append((element, child))
+                    elif type(element) == list:
+                        return None
+
+        # Every bracket of the raw line belongs to a node of the plan, or there are unknown nodes or
+        # brackets in strings, told apart by counting the objects and arrays left once redacted
+        if containers != 0 and count_containers(event) != nodes:
+            return None
+        return redacted
+
+    def walk(self, event: dict, learn: bool = True) -> tuple:
+        """Replace the values of the PII keys by walking every node of an event.
+
+        The walk is iterative, so that deeply nested events can't hit the recursion
+        limit.
+
+        Args:
+            event: The JSON object to be processed.
+            learn: Whether to learn the redaction plan of the event. Defaults to True.
+
+        Returns:
+            The number of replaced values and the redaction plan of the event, or None
+            when it is not learned or its arrays are too heterogeneous to be described
+            by a plan.
+        """
+        redacted = 0
+        plannable = learn
+        key_matches = self.key_matches
+        nodes = list()
+        root = [None, None]
+        stack = [(event, root)]
+        while stack:
+            object, slot = stack.pop()
+            if type(object) == dict:
+                pii_keys, children = list(), list()
+                if plannable:
+                    slot[1] = ['dict', tuple(object), pii_keys, children]
+                    nodes.append(slot[1])
+                for key, value in object.items():
+                    match = key_matches.get(key)
+                    if match is None:
+                        match = self.is_pii_key(key)
+                    if match:
+                        pii_keys.append(key)
+                    elif type(value) in CONTAINER_TYPES:
+                        child = [key, None]
+                        children.append(child)
+                        stack.append((value, child))
+                for key in pii_keys:
+                    object[key] = None
+                redacted += len(pii_keys)
+            elif type(object) == list:
+                elements = list()
+                if plannable:
+                    slot[1] = ['list', elements]
+                    nodes.append(slot[1])
+                for element in object:
+                    if type(element) == dict:
+                        child = [tuple(element), None]
+                        elements.append(child)
+                        stack.append((element, child))
+                    elif type(element) == list:
+                        plannable = False
+                        stack.append((element, [None, None]))
+
+        if not plannable or root[1] is None:
+            return redacted, None
+
+        # Freeze the nodes from the leaves to the root
+        frozen = dict()
+        for node in reversed(nodes):
+            if node[0] == 'dict':
+                _, keys, pii_keys, children = node
+                children = tuple((key, frozen[id(child)]) for key, child in children)
+                frozen[id(node)] = ('dict', keys, tuple(pii_keys), children)
+            else:
+                elements = dict()
+                for key, child in node[1]:
+                    child = frozen[id(child)]
+                    if elements.setdefault(key, child) != child:
+                        return redacted, None
+                frozen[id(node)] = ('list', elements)
+        return redacted, frozen[id(root[1])]
+
+    def find_paths(self, event: dict) -> list[str]:
+        """Return the key paths of the PII values of an event, without replacing them.
+
+        The paths join the keys with dots, the elements of an array sharing the path
+        of the array followed by [], e.g. properties.items[].account_id.
+
+        Args:
+            event: The JSON object to be scanned.
+
+        Returns:
+            The key paths, once per PII value.
+        """
+        paths = list()
+        stack = [(event, '')]
+        while stack:
+            object, path = stack.pop()
+            if type(object) == dict:
+                for key, value in object.items():
+                    key_path = f'{path}.{key}' if path else key
+                    if self.is_pii_key(key):
+                        paths.append(key_path)
+                    elif type(value) in CONTAINER_TYPES:
+                        stack.append((value, key_path))
+            elif type(object) == list:
+                for element in object:
+                    if type(element) in CONTAINER_TYPES:
+                        stack.append((element, path + '[]'))
+        return paths
+
+    def redact_line(self, line: bytes) -> bytes:
+        """Replace the values of the PII keys of a raw JSON line.
+
+        The line is only parsed when its bytes contain one of the PII key patterns
+        or an escaped character, and is returned unchanged when none of its keys
+        had to be replaced.
+
+        Args:
+            line: The raw JSON document, without its line terminator.
+
+        Returns:
+            The processed JSON document.
+        """
+        if not self.may_hold_pii(line):
+            return line
+        object = self.serializer.loads(line)
+        if self.redact_values(object, line.count(b'{') + line.count(b'[')) == 0:
+            return line
+        return self.serializer.dumps(object)
+
+
+def redact_chunk(redactor: PIIRedactor, chunk: bytes) -> bytes:
+    """Return the redacted lines of a line-aligned NDJSON chunk, separated by commas."""
+    lines = (line.rstrip(b'\r') for line in chunk.split(b'\n'))
+    return b','.join(redactor.redact_line(line) for line in lines if line.strip())
+
+
+def redact_chunks(connection, pii_keys: list[str], json_backend: str) -> None:
+    """Redact the NDJSON chunks received on a connection until an empty one, in a worker process.
+
+    Each chunk is answered with its redacted lines separated by commas, prefixed
+    with b'0', or with the description of the failure prefixed with b'1'.
+
+    Args:
+        connection: The worker end of the pipe to the function.
+        pii_keys: The key substrings whose values should be replaced.
+        json_backend: The JSON backend of the redactor, among JSON_BACKENDS.
+    """
+    redactor = PIIRedactor(pii_keys, get_serializer(json_backend))
+    while True:
+        chunk = connection.recv_bytes()
+        if not chunk:
+            break
+        try:
+            connection.send_bytes(b'0' + redact_chunk(redactor, chunk))
+        except Exception as error:
+            connection.send_bytes(b'1' + ''.join(traceback.format_exception_only(type(error), error)).encode('utf-8'))
+    connection.close()
+
+
+class RedactionPool():
+    """Pool of processes redacting the line-aligned chunks of a NDJSON file in parallel.
+
+    Lambda provides no shared memory, which multiprocessing.Pool and Queue need,
+    so each worker process is fed through its own pipe. The chunks are sent to
+    the workers in turn, a single chunk being in flight per worker, and their
+    results are read in the same order, so that they come out in the order of
+    the file.
+
+    A single pool is started by an invocation, before any thread since the workers
+    are forked, and the files processed concurrently use it one at a time. Once a
+    worker died, e.g. killed by the out-of-memory killer, the pool is broken: its
+    workers are stopped and the chunks are redacted in the calling threads instead.
+    """
+    def __init__(self, pii_keys: list[str], json_backend: str, workers: int):
+        """Start the worker processes.
+
+        Args:
+            pii_keys: The key substrings whose values should be replaced.
+            json_backend: The JSON backend of the workers, among JSON_BACKENDS.
+            workers: The number of worker processes.
+        """
+        context = multiprocessing.get_context('fork')
+        self.pii_keys = pii_keys
+        self.json_backend = json_backend
+        self.broken = False
+        self.lock = threading.Lock()
+        self.connections = list()
+        self.processes = list()
+        for _ in range(workers):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=redact_chunks, args=(worker_connection, pii_keys, json_backend))
+            process.daemon = True
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def receive(self, in_flight: collections.deque) -> bytes:
+        """Return the redacted chunk of the oldest chunk in flight, raising the failure of its worker.
+
+        The chunk stays in flight when its worker died, raising EOFError or OSError.
+        """
+        connection, _ = in_flight[0]
+        result = connection.recv_bytes()
+        in_flight.popleft()
+        if result[:1] != b'0':
+            raise RuntimeError(f"A redaction worker failed: {result[1:].decode('utf-8').strip()}")
+        return result[1:]
+
+    def stop_broken(self, error: Exception) -> None:
+        """Stop the workers once one of them died, without waiting on its pipe."""
+        logger.warning(f"A redaction worker died, the chunks are redacted in process: {error!r}")
+        self.broken = True
+        self.terminate()
+
+    def map(self, chunks):
+        """Yield the redacted lines of each chunk, separated by commas, in the order of the chunks.
+
+        The pool is held until the generator is exhausted or closed, the results of
+        the chunks still in flight being then discarded. When a worker dies, the
+        chunks in flight and the next ones are redacted in the calling thread.
+
+        Args:
+            chunks: The iterable of line-aligned NDJSON chunks.
+        """
+        chunks = iter(chunks)
+        in_flight = collections.deque()
+        with self.lock:
+            try:
+                if not self.broken:
+                    for index, chunk in enumerate(chunks):
+                        connection = self.connections[index % len(self.connections)]
+                        in_flight.append((connection, chunk))
+                        connection.send_bytes(chunk)
+                        # With every worker busy, the oldest chunk in flight is the one of the next worker
+                        if len(in_flight) == len(self.connections):
+                            yield self.receive(in_flight)
+
+                    while in_flight:
+                        yield self.receive(in_flight)
+            except (EOFError, OSError) as error:
+                self.stop_broken(error)
+            finally:
+                # The next file should not read the results of a file given up midway
+                try:
+                    while in_flight and not self.broken:
+                        in_flight.popleft()[0].recv_bytes()
+                except (EOFError, OSError) as error:
+                    self.stop_broken(error)
+
+        redactor = PIIRedactor(self.pii_keys, get_serializer(self.json_backend))
+        for _, chunk in in_flight:
+            yield redact_chunk(redactor, chunk)
+        for chunk in chunks:
+            yield redact_chunk(redactor, chunk)
+
+    def close(self) -> None:
+        """Stop the worker processes once they are done with their chunk."""
+        if self.broken:
+            return
+        for connection in self.connections:
+            connection.send_bytes(b'')
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+    def terminate(self) -> None:
+        """Stop the worker processes right away."""
+        for process in self.processes:
+            process.terminate()
+        for connection in self.connections:
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self) -> 'RedactionPool':
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback) -> None:
+        if exception_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+def compress_gzip_member(data: bytes, level: int = COMPRESSION_LEVEL) -> bytes:
+    """Compress a block of data into an independent gzip member.
+
+    The total size of the member is stored in an extra field of its header, so
+    that a reader can find the next member without decompressing this one. Readers
+    unaware of this field ignore it, as specified by RFC 1952.
+
+    Args:
+        data: The uncompressed block.
+        level: The zlib compression level. Defaults to COMPRESSION_LEVEL.
+
+    Returns:
+        The gzip member.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    extra_flags = 2 if level == 9 else 4 if level == 1 else 0
+    member_size = 10 + 2 + 8 + len(deflated) + 8
+    header = struct.pack('<BBBBIBBH', 0x1f, 0x8b, 8, 4, 0, extra_flags, 255, 8)
+    extra = GZIP_MEMBER_SIZE_ID + struct.pack('<HI', 4, member_size)
+    trailer = struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff)
+    return header + extra + deflated + trailer
+
+
+def read_exactly(fileobj, size: int) -> bytes:
+    """Read a number of bytes from a file object, or less at the end of the file."""
+    data = fileobj.read(size)
+    while 0 < len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class ChainedReader(io.RawIOBase):
+    """Readable file object replaying bytes already consumed from another file object."""
+    def __init__(self, prefix: bytes, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = self.fileobj.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """Writable file object compressing its content on several threads.
+
+    The content is split into blocks compressed as independent gzip members, whose
+    concatenation is a valid gzip file. zlib releases the GIL while compressing, so
+    the blocks are compressed on as many cores as there are workers.
+    """
+    def __init__(
+        self,
+        fileobj,
+        level: int = COMPRESSION_LEVEL,
+        max_workers: int = 1,
+        block_size: int = GZIP_BLOCK_SIZE,
+    ):
+        """Initialize the compression pool.
+
+        Args:
+            fileobj: The file object where to write the compressed content.
+            level: The zlib compression level. Defaults to COMPRESSION_LEVEL.
+            max_workers: The number of blocks compressed concurrently. Defaults to 1.
+            block_size: The size in bytes of the uncompressed blocks. Defaults to GZIP_BLOCK_SIZE.
+        """
+        self.fileobj = fileobj
+        self.level = level
+        self.max_workers = max_workers
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = list()
+        self.members = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        """Buffer the data and compress every complete block."""
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def submit(self, block: bytes) -> None:
+        """Compress a block, writing the compressed blocks in order once the pool is full."""
+        self.pending.append(self.executor.submit(compress_gzip_member, block, self.level))
+        self.members += 1
+        while len(self.pending) > 2 * self.max_workers:
+            self.fileobj.write(self.pending.pop(0).result())
+
+    def close(self) -> None:
+        """Compress the remaining data and write all the compressed blocks."""
+        if self.closed:
+            return
+        if self.buffer or self.members == 0:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        for future in self.pending:
+            self.fileobj.write(future.result())
+        self.pending = list()
+        self.executor.shutdown()
+        super().close()
+
+    def __exit__(self, exception_type, exception_value, exception_traceback) -> None:
+        if exception_type is None:
+            self.close()
+        else:
+            for future in self.pending:
+                future.cancel()
+            self.executor.shutdown()
+            super().close()
+
+
+class ParallelGzipReader(io.RawIOBase):
+    """Readable file object decompressing a multi-member gzip file on several threads.
+
+    The members written by ParallelGzipWriter are decompressed concurrently. Other
+    gzip files, whose members sizes are unknown, are decompressed sequentially.
+    """
+    def __init__(self, fileobj, max_workers: int = 1):
+        """Initialize the decompression pool.
+
+        Args:
+            fileobj: The file object of the compressed content.
+            max_workers: The number of members decompressed concurrently. Defaults to 1.
+        """
+        self.fileobj = fileobj
+        self.max_workers = max_workers
+        self.blocks = self.iter_blocks()
+        self.block = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.block:
+            block = next(self.blocks, None)
+            if block is None:
+                return 0
+            self.block = memoryview(block)
+        size = min(len(buffer), len(self.block))
+        buffer[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
+
+    def read_member(self) -> tuple:
+        """Read the next member when its size is stored in its header.
+
+        Returns:
+            The member, or None with the bytes read when its size is unknown.
+        """
+        header = read_exactly(self.fileobj, 12)
+        if len(header) < 12 or header[:2] != b'\x1f\x8b' or not header[3] & 4:
+            return None, header
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        extra = read_exactly(self.fileobj, extra_length)
+        position = 0
+        while position + 4 <= len(extra):
+            field_id = extra[position:position + 2]
+            field_length = struct.unpack('<H', extra[position + 2:position + 4])[0]
+            if field_id == GZIP_MEMBER_SIZE_ID and field_length == 4:
+                member_size = struct.unpack('<I', extra[position + 4:position + 8])[0]
+                body = read_exactly(self.fileobj, member_size - len(header) - len(extra))
+                return header + extra + body, None
+            position += 4 + field_length
+        return None, header + extra
+
+    def iter_blocks(self):
+        """Yield the decompressed blocks in order."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = list()
+            while True:
+                member, consumed = self.read_member()
+                if member is None:
+                    break
+                pending.append(executor.submit(zlib.decompress, member, 16 + zlib.MAX_WBITS))
+                while len(pending) > 2 * self.max_workers:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+        if consumed:
+            with gzip.GzipFile(fileobj=ChainedReader(consumed, self.fileobj)) as gzipfile:
+                for block in iter(lambda: gzipfile.read(GZIP_BLOCK_SIZE), b''):
+                    yield block
+
+
+class RangedObjectReader(io.RawIOBase):
+    """Readable file object downloading a S3 object with concurrent byte-range requests.
+
+    The parts are downloaded into a fixed set of reusable buffers and read in order,
+    while the next parts are still downloading. The parts are requested with the
+    expected ETag of the object, or else the ETag of the first one, so that a file
+    overwritten during the download fails instead of being mixed up.
+    """
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        file_path: str,
+        part_size: int = DOWNLOAD_PART_SIZE,
+        max_concurrency: int = DOWNLOAD_CONCURRENCY,
+        etag: str = None,
+    ):
+        """Download the first part of the object and start downloading the next ones.
+
+        Args:
+            s3_client: The S3 client used for the download.
+            bucket: The S3 bucket where the file is stored.
+            file_path: The path of the file to be downloaded.
+            part_size: The size in bytes of the ranges requested. Defaults to DOWNLOAD_PART_SIZE.
+            max_concurrency: The number of ranges downloaded concurrently. Defaults to DOWNLOAD_CONCURRENCY.
+            etag: The ETag the object should match. Defaults to None.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.file_path = file_path
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.buffers = queue.Queue()
+        for _ in range(max_concurrency + 1):
+            self.buffers.put(bytearray(part_size))
+        self.pending = list()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+
+        try:
+            self.buffer, size, response = self.download_part(0, etag)
+        except ClientError as error:
+            # Empty objects can't be requested by range
+            if error.response.get('Error', {}).get('Code') != 'InvalidRange':
+                raise
+            request = {'Bucket': bucket, 'Key': file_path}
+            if etag:
+                request['IfMatch'] = etag
+            self.buffer, size, response = None, 0, self.s3_client.head_object(**request)
+        self.etag = response.get('ETag')
+        self.size = int(response['ContentRange'].split('/')[-1]) if response.get('ContentRange') else size
+        self.view = memoryview(self.buffer)[:size] if self.buffer else memoryview(b'')
+        self.next_offset = size
+        self.schedule()
+
+    def readable(self) -> bool:
+        return True
+
+    def download_part(self, offset: int, etag: str = None) -> tuple:
+        """Download a range of the object into a free buffer.
+
+        Args:
+            offset: The position of the first byte of the range.
+            etag: The ETag the object should match. Defaults to None.
+
+        Returns:
+            The buffer, the size of the range and the S3 response.
+        """
+        buffer = self.buffers.get()
+        try:
+            request = dict(
+                Bucket=self.bucket,
+                Key=self.file_path,
+                Range=f'bytes={offset}-{offset + self.part_size - 1}'
+            )
+            if etag:
+                request['IfMatch'] = etag
+            response = self.s3_client.get_object(**request)
+            body = response['Body']
+            size = 0
+            while size < self.part_size:
+                chunk = body.read(min(DOWNLOAD_READ_SIZE, self.part_size - size))
+                if not chunk:
+                    break
+                buffer[size:size + len(chunk)] = chunk
+                size += len(chunk)
+            return buffer, size, response
+        except Exception:
+            self.buffers.put(buffer)
+            raise
+
+    def schedule(self) -> None:
+        """Start downloading the next parts, up to the maximum concurrency."""
+        while len(self.pending) < self.max_concurrency and self.next_offset < self.size:
+            self.pending.append(self.executor.submit(self.download_part, self.next_offset, self.etag))
+            self.next_offset += self.part_size
+
+    def readinto(self, buffer) -> int:
+        while not self.view:
+            if self.buffer is not None:
+                self.buffers.put(self.buffer)
+                self.buffer = None
+            if not self.pending:
+                return 0
+            self.buffer, size, _ = self.pending.pop(0).result()
+            self.view = memoryview(self.buffer)[:size]
+            self.schedule()
+        size = min(len(buffer), len(self.view))
+        buffer[:size] = self.view[:size]
+        self.view = self.view[size:]
+        return size
+
+    def close(self) -> None:
+        """Cancel the parts not downloaded yet."""
+        if self.closed:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.executor.shutdown()
+        super().close()
+
+
+class SegmentParquetWriter():
+    """Write Segment events to Parquet files, one per event type.
+
+    The schema of each event type is inferred from its first row group: scalar
+    fields get their own typed column and nested objects are stored as JSON strings.
+    The fields missing from the schema or not matching its types are kept as a JSON
+    object in an extra column, so that no value is lost. Row groups are uploaded as
+    soon as they are complete, and a manifest listing the files, in the format used
+    by Redshift COPY, is written on close.
+    """
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        file_path: str,
+        row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+        serializer: JSONSerializer = None,
+        metadata: dict = None,
+    ):
+        """Initialize the writer.
+
+        Args:
+            s3_client: The S3 client used for the uploads.
+            bucket: The S3 bucket where to write the processed files.
+            file_path: The path of the raw file, from which the Parquet files paths are derived.
+            row_group_size: The number of events per row group. Defaults to PARQUET_ROW_GROUP_SIZE.
+            serializer: The JSON serializer of the nested values. Defaults to the standard library one.
+            metadata: The user metadata of the Parquet files and of their manifest. Defaults to None.
+        """
+        if pyarrow is None:
+            raise ImportError("The Parquet output mode requires the pyarrow package.")
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.file_path = file_path
+        self.row_group_size = row_group_size
+        self.serializer = serializer or JSONSerializer()
+        self.metadata = metadata or {}
+        self.rows = dict()
+        self.writers = dict()
+
+    def get_file_path(self, event_type: str) -> str:
+        """Return the path of the Parquet file of an event type."""
+        return re.sub('.gz$', f'.{event_type}.parquet', self.file_path)
+
+    def get_manifest_path(self) -> str:
+        """Return the path of the manifest listing the Parquet files."""
+        return re.sub('.gz$', '.parquet.manifest', self.file_path)
+
+    def write(self, event: dict) -> None:
+        """Buffer an event and write the row group of its type once complete."""
+        event_type = re.sub('[^0-9A-Za-z_-]', '_', str(event.get('type') or 'unknown'))[:64]
+        rows = self.rows.setdefault(event_type, list())
+        rows.append(event)
+        if len(rows) >= self.row_group_size:
+            self.flush(event_type)
+
+    def infer_schema(self, rows: list[dict]) -> 'pyarrow.Schema':
+        """Infer the schema of an event type from a row group."""
+        value_types = dict()
+        for row in rows:
+            for key, value in row.items():
+                if value is not None:
+                    value_types.setdefault(key, set()).add(type(value))
+                else:
+                    value_types.setdefault(key, set())
+
+        fields = list()
+        for key, types in value_types.items():
+            if key == PARQUET_EXTRA_COLUMN:
+                continue
+            if types == {bool}:
+                field_type = pyarrow.bool_()
+            elif types == {int}:
+                field_type = pyarrow.int64()
+            elif types and types <= {int, float}:
+                field_type = pyarrow.float64()
+            else:
+                field_type = pyarrow.string()
+            fields.append(pyarrow.field(key, field_type))
+        fields.append(pyarrow.field(PARQUET_EXTRA_COLUMN, pyarrow.string()))
+        return pyarrow.schema(fields)
+
+    def convert(self, value, field_type) -> tuple:
+        """Convert a value to the type of its column.
+
+        Returns:
+            Whether the value fits the column, and the converted value.
+        """
+        if value is None:
+            return True, None
+        if field_type == pyarrow.string():
+            return True, value if type(value) == str else self.serializer.dumps(value).decode('utf-8')
+        if field_type == pyarrow.bool_():
+            return type(value) == bool, value
+        if field_type == pyarrow.int64():
+            return type(value) == int and -2**63 <= value < 2**63, value
+        if type(value) in (int, float):
+            return True, float(value)
+        return False, None
+
+    def flush(self, event_type: str) -> None:
+        """Write the buffered events of a type as a row group."""
+        rows = self.rows.pop(event_type, None)
+        if not rows:
+            return
+
+        if event_type not in self.writers:
+            schema = self.infer_schema(rows)
+            sink = lambda_runtime.S3MultipartWriter(
+                self.s3_client, self.bucket, self.get_file_path(event_type), metadata=self.metadata
+            )
+            self.writers[event_type] = (pyarrow.parquet.ParquetWriter(sink, schema), sink)
+        writer, _ = self.writers[event_type]
+
+        columns = {field.name: list() for field in writer.schema}
+        for row in rows:
+            extra = dict()
+            for field in writer.schema:
+                if field.name == PARQUET_EXTRA_COLUMN:
+                    continue
+                fits, value = self.convert(row.get(field.name), field.type)
+                columns[field.name].append(value if fits else None)
+                if not fits:
+                    extra[field.name] = row[field.name]
+            for key, value in row.items():
+                if key not in columns or key == PARQUET_EXTRA_COLUMN:
+                    extra[key] = value
+            columns[PARQUET_EXTRA_COLUMN].append(self.serializer.dumps(extra).decode('utf-8') if extra else None)
+
+        writer.write_table(pyarrow.table(columns, schema=writer.schema))
+
+    def close(self) -> None:
+        """Write the remaining events, complete the uploads and write the manifest."""
+        for event_type in list(self.rows):
+            self.flush(event_type)
+
+        entries = list()
+        for event_type, (writer, sink) in sorted(self.writers.items()):
+            writer.close()
+            sink.close()
+            entries.append({
+                'url': f's3://{self.bucket}/{self.get_file_path(event_type)}',
+                'mandatory': True,
+                'meta': {'content_length': sum(part['Size'] for part in sink.parts)}
+            })
+
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.get_manifest_path(),
+            Body=json.dumps({'entries': entries}).encode('utf-8'),
+            Metadata=self.metadata
+        )
+
+    def abort(self) -> None:
+        """Abort the uploads of the Parquet files."""
+        for _, sink in self.writers.values():
+            sink.abort()
+
+    def __enter__(self) -> 'SegmentParquetWriter':
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback) -> None:
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
 
 class JSONCleaner():
     """The Lambda function is triggered by a S3 event notification or a
     S3 batch operations task. It is used to clean up the raw files dumped
     by Segment from potential PIIs.
     """
-    def __init__(self):
-        """Initialize the Lambda function."""
+    def __init__(
+        self,
+        pii_keys: list[str] = PII_FIELDS,
+        streaming: bool = True,
+        max_workers: int = 1,
+        context=None,
+        compression_level: int = COMPRESSION_LEVEL,
+        compression_workers: int = 1,
+        download_part_size: int = DOWNLOAD_PART_SIZE,
+        download_concurrency: int = DOWNLOAD_CONCURRENCY,
+        output_format: str = 'json',
+        dry_run: bool = False,
+        json_backend: str = 'auto',
+        redaction_pool: RedactionPool = None,
+        redaction_chunk_size: int = REDACTION_CHUNK_MAX_SIZE,
+        redaction_min_size: int = REDACTION_POOL_MIN_SIZE,
+    ):
+        """Initialize the Lambda function.
+
+        Args:
+            pii_keys: The key substrings whose values should be replaced. Defaults to PII_FIELDS.
+            streaming: Whether to process the files line by line instead of in memory. Defaults to True.
+            max_workers: The maximum number of files processed concurrently. Defaults to 1.
+            context: The Lambda invocation context, bounding the time spent on retries. Defaults to None.
+            compression_level: The zlib compression level of the processed files. Defaults to COMPRESSION_LEVEL.
+            compression_workers: The number of threads (de)compressing each file. Defaults to 1.
+            download_part_size: The size in bytes of the ranges downloaded. Defaults to DOWNLOAD_PART_SIZE.
+            download_concurrency: The number of ranges of a file downloaded concurrently.
+                Defaults to DOWNLOAD_CONCURRENCY.
+            output_format: The format of the processed files, among OUTPUT_FORMATS. Defaults to 'json'.
+            dry_run: Whether to only audit the files for PIIs, without rewriting them. Defaults to False.
+            json_backend: The library parsing and serializing the events, among JSON_BACKENDS.
+                Defaults to 'auto', using orjson when it is installed.
+            redaction_pool: The pool of processes redacting the chunks of the large streamed JSON files,
+                shared by the files of the invocation. Defaults to None, the files being redacted by their thread.
+            redaction_chunk_size: The size in bytes of the chunks sent to the redaction processes.
+                Defaults to REDACTION_CHUNK_MAX_SIZE.
+            redaction_min_size: The compressed size in bytes from which a file is redacted by the pool.
+                Defaults to REDACTION_POOL_MIN_SIZE.
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"The output format should be one of {OUTPUT_FORMATS}, not {output_format}.")
+
         self.execution_date = datetime.datetime.now()
-        self.s3_client = boto3.client('s3')
+        self.max_workers = max_workers
+        self.context = context
+        self.compression_level = compression_level
+        self.compression_workers = compression_workers
+        self.download_part_size = download_part_size
+        self.download_concurrency = download_concurrency
+        self.output_format = output_format
+        self.dry_run = dry_run
+        # The client is shared by the threads, each one holding up to its downloads and an upload,
+        # and by the warm invocations
+        self.s3_client = lambda_runtime.get_client(
+            's3',
+            max_pool_connections=max(10, (download_concurrency + 2) * max_workers),
+            retries={'mode': 'adaptive', 'max_attempts': self.get_max_retries()}
+        )
+        self.pii_keys = pii_keys
+        self.json_backend = json_backend
+        self.redaction_pool = redaction_pool
+        self.redaction_chunk_size = redaction_chunk_size
+        self.redaction_min_size = redaction_min_size
+        self.serializer = get_serializer(json_backend)
+        self.redactor = PIIRedactor(pii_keys, self.serializer)
+        self.config_hash = self.get_config_hash()
+        self.streaming = streaming
+
+    def get_remaining_time(self) -> int:
+        """Return the time left in milliseconds before the Lambda invocation times out."""
+        if self.context is None:
+            return sys.maxsize
+        return self.context.get_remaining_time_in_millis()
+
+    def get_max_retries(self) -> int:
+        """Return the number of retries of a S3 request fitting in the invocation time."""
+        attempts = (self.get_remaining_time() - TIME_BUDGET_MARGIN_MS) // RETRY_BUDGET_MS
+        return int(max(1, min(MAX_RETRIES, attempts)))
+
+    def check_time_budget(self) -> None:
+        """Stop the processing when the invocation is about to time out.
+
+        Raises:
+            TimeBudgetExceeded: The remaining time is below the safety margin.
+        """
+        remaining_time = self.get_remaining_time()
+        if remaining_time < TIME_BUDGET_MARGIN_MS:
+            raise TimeBudgetExceeded(f"Only {remaining_time} ms left before the Lambda invocation times out.")
+
+    def get_config_hash(self) -> str:
+        """Return the hash of the settings changing the content of the processed files."""
+        config = {'version': REDACTION_VERSION, 'pii_keys': self.redactor.pii_keys, 'output_format': self.output_format}
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def get_output_metadata(self, etag: str = None) -> dict:
+        """Return the user metadata stamped on the processed files of a raw file."""
+        metadata = {REDACTION_CONFIG_METADATA: self.config_hash}
+        if etag:
+            metadata[SOURCE_ETAG_METADATA] = etag.strip('"')
+        return metadata
+
+    def get_marker_path(self, file_path: str) -> str:
+        """Return the path of the processed file written last for a raw file, holding its metadata."""
+        if self.output_format == 'parquet':
+            return re.sub('.gz$', '.parquet.manifest', file_path)
+        return self.get_destination_path(file_path)
+
+    def head_object(self, bucket: str, file_path: str) -> dict:
+        """Return the HEAD response of a S3 object, or None when it does not exist."""
+        try:
+            return self.s3_client.head_object(Bucket=bucket, Key=file_path)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def is_processed(self, bucket: str, file_path: str, etag: str = None) -> tuple:
+        """Whether a raw file was already processed with the same redaction settings.
+
+        The processed file written last is checked with a HEAD request. When the
+        ETag of the raw file is not known from the event, the raw file is checked
+        with a second one, a missing raw file having been deleted once processed.
+
+        Args:
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the raw file.
+            etag: The ETag of the raw file. Defaults to None.
+
+        Returns:
+            Whether the processed file holds the metadata of the raw file and settings,
+            and the ETag of the raw file, None when it is not known from the event nor
+            was requested.
+        """
+        marker = self.head_object(bucket, self.get_marker_path(file_path))
+        if marker is None:
+            return False, etag
+        metadata = marker.get('Metadata', {})
+        if metadata.get(REDACTION_CONFIG_METADATA) != self.config_hash:
+            return False, etag
+
+        if etag is None:
+            source = self.head_object(bucket, file_path)
+            if source is None:
+                return True, None
+            etag = source['ETag']
+        return metadata.get(SOURCE_ETAG_METADATA) == etag.strip('"'), etag
+
+    def delete_processed_source(self, bucket: str, file_path: str, etag: str) -> None:
+        """Delete a raw file already processed, left behind by a run stopped before its deletion.
+
+        The raw file is only deleted while it still has the ETag stamped on its
+        processed file, so that a raw file uploaded again since is not lost.
+
+        Args:
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the raw file.
+            etag: The ETag of the raw file stamped on its processed file.
+        """
+        source = self.head_object(bucket, file_path)
+        if source is None or source['ETag'].strip('"') != etag.strip('"'):
+            return
+        self.s3_client.delete_object(Bucket=bucket, Key=file_path)
+        logger.info(f"Deleted {file_path}, already processed with the same settings.")
+
+    def open_object(self, bucket: str, file_path: str, etag: str = None) -> RangedObjectReader:
+        """Return a file object downloading a S3 object with concurrent ranged requests."""
+        return RangedObjectReader(
+            self.s3_client, bucket, file_path, self.download_part_size, self.download_concurrency, etag
+        )
+
+    def open_gzip(self, fileobj) -> io.BufferedReader:
+        """Return a file object decompressing a gzip file, in parallel when possible."""
+        return io.BufferedReader(ParallelGzipReader(fileobj, self.compression_workers), GZIP_BLOCK_SIZE)
+
+    def create_gzip(self, fileobj) -> ParallelGzipWriter:
+        """Return a file object compressing its content to a gzip file in parallel."""
+        return ParallelGzipWriter(fileobj, self.compression_level, self.compression_workers)
 
-    def download_file(self, bucket: str, file_path: str) -> str:
+    def download_file(self, bucket: str, file_path: str, etag: str = None) -> bytes:
         """Extract a zipped file from S3 and returns its content."
 
         Args:
             bucket: The S3 bucket where the raw files are stored.
             file_path: The path of the file to be processed.
+            etag: The ETag the raw file should match. Defaults to None.
 
         Returns:
-            The raw content of the file to be processed.
+            The raw content of the file to be processed, as UTF-8 bytes.
         """
-        obj = self.s3_client.get_object(Bucket=bucket, Key=file_path)
-        with gzip.GzipFile(fileobj=obj.get("Body")) as gzipfile:
-            content = gzipfile.read().decode()
+        with self.open_object(bucket, file_path, etag) as obj, self.open_gzip(obj) as gzipfile:
+            content = gzipfile.read()
         return content
 
-    def parse_file(self, file: str) -> list:
+    def parse_file(self, file: bytes) -> list:
         """Parse the binary string of an S3 bucket into a list of json.
 
         Args:
@@ -47,62 +1356,107 @@ class JSONCleaner():
         Returns:
             The parsed raw file.
         """
-        parsed_file = [json.loads(itm) for itm in file.split('\n') if len(itm) > 0]
+        parsed_file = [self.serializer.loads(itm) for itm in file.split(b'\n') if len(itm.strip()) > 0]
         return parsed_file
 
     def search_file(
         self,
         lookup_key: str,
         object: dict,
-        search_result=list(),
+        search_result: list = None,
     ) -> list[dict]:
         """Extract the values of a lookup key from a json file.
 
-        We extract the values by recursively navigating the different level of the file.
+        We extract the values by iteratively navigating the different level of the file.
 
         Args:
             lookup_key: The key for which value should be replaced.
             object: The JSON object to be processed.
-            search_result: The result of the file search. Defaults to list().
+            search_result: The list to which the results are appended. Defaults to a new list.
 
         Returns:
-            The unprocessed file content.
+            The keys containing the lookup key with their value, as one dict per key.
         """
-        if type(object) == dict:
-            for key, value in object.items():
-                if lookup_key.lower() in key.lower():
-                    search_result.append(dict(key=value))
-                self.search_file(lookup_key, value, search_result)
+        if search_result is None:
+            search_result = list()
 
-        elif type(object) == list:
-            for element in object:
-                self.search_file(lookup_key, element, search_result)
+        lookup_key = lookup_key.lower()
+        stack = [object]
+        while stack:
+            object = stack.pop()
+            if type(object) == dict:
+                for key, value in object.items():
+                    if lookup_key in key.lower():
+                        search_result.append({key: value})
+                stack.extend(reversed(object.values()))
+            elif type(object) == list:
+                stack.extend(reversed(object))
 
         return search_result
 
-    def cleanup_file(self, lookup_key: str, object: dict) -> list[dict]:
-        """Replace the values of a lookup keyfrom a json file with None by recursively
-        navigating the different level of the file.
+    def cleanup_file(self, object: dict) -> list[dict]:
+        """Replace the values of all the PII keys from a json file with None in
+        a single pass over the different levels of the file.
 
         Args:
-            lookup_key: The key for which value should be replaced.
             object: The JSON object to be processed.
 
         Returns:
             The processed file content.
         """
+        return self.redactor.redact(object)
 
-        if type(object) == dict:
-            for key, value in object.items():
-                if lookup_key.lower() in key.lower():
-                    object[key] = None
-                self.cleanup_file(lookup_key, value)
-        elif type(object) == list:
-            for element in object:
-                self.cleanup_file(lookup_key, element)
-        return object
+    def process_file(self, bucket: str, file_path: str, etag: str = None) -> dict:
+        """Clean up a raw file from its PIIs with a single download and upload.
+
+        The raw files already processed with the same settings are skipped, the
+        processed files being stamped with the ETag of their raw file and the hash
+        of the settings, and deleted when still there.
+
+        Args:
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the file to be processed.
+            etag: The ETag of the raw file, when known from the event. Defaults to None.
+
+        Returns:
+            The audit record of the file in dry-run mode, None otherwise.
+        """
+        self.check_time_budget()
+
+        if self.dry_run:
+            record = self.audit_file(bucket, file_path)
+            logger.info(json.dumps(record, separators=(',', ':')))
+            return record
+
+        # The ETag of the raw file requested to check its processed file is reused for its download
+        processed, etag = self.is_processed(bucket, file_path, etag)
+        if processed:
+            logger.info(f"Skipped {file_path}, already processed with the same settings.")
+            if etag is not None:
+                self.delete_processed_source(bucket, file_path, etag)
+            return
 
-    def write_file(self, bucket: str, file_path: str, data: str, replace=False) -> None:
+        if etag is None:
+            etag = self.s3_client.head_object(Bucket=bucket, Key=file_path)['ETag']
+
+        if self.output_format == 'parquet':
+            self.stream_parquet_file(bucket, file_path, replace=True, etag=etag)
+            return
+
+        if self.streaming:
+            self.stream_file(bucket, file_path, replace=True, etag=etag)
+            return
+
+        file_raw = self.download_file(bucket, file_path, etag)
+        file_parsed = self.parse_file(file_raw)
+        file_cleaned = self.cleanup_file(file_parsed)
+        self.write_file(bucket, file_path, file_cleaned, replace=True, etag=etag)
+
+    def get_destination_path(self, file_path: str) -> str:
+        """Return the path of the processed file for a raw file path."""
+        return re.sub('.gz$', '.json.gzip', file_path)
+
+    def write_file(self, bucket: str, file_path: str, data: list, replace=False, etag: str = None) -> None:
         """Compresse processed file to gzip and write it to s3.
 
         Args:
@@ -110,54 +1464,295 @@ class JSONCleaner():
             file_path: The path of the file to be written in S3.
             data: The content of the file to be written.
             replace: Whether to remove the original file. Defaults to False.
+            etag: The ETag of the raw file, stamped on the processed file. Defaults to None.
         """
 
         file_src_path = file_path
-        file_dst_path = re.sub('.gz$', '.json.gzip', file_src_path)
+        file_dst_path = self.get_destination_path(file_src_path)
 
         inmem = io.BytesIO()
-        with gzip.GzipFile(fileobj=inmem, mode='wb') as fh:
-            with io.TextIOWrapper(fh, encoding='utf-8') as wrapper:
-                wrapper.write(json.dumps(data, ensure_ascii=False, default=None))
+        with self.create_gzip(inmem) as fh:
+            fh.write(self.serializer.dumps(data))
 
         inmem.seek(0)
 
-        self.s3_client.put_object(Bucket=bucket, Body=inmem, Key=file_dst_path)
+        self.s3_client.put_object(
+            Bucket=bucket, Body=inmem, Key=file_dst_path, Metadata=self.get_output_metadata(etag)
+        )
 
         if replace == True:
             self.s3_client.delete_object(Bucket=bucket, Key=file_src_path)
 
         return
 
-    def process_s3_batch_operations(self, event: dict, pii_key: str) -> None:
-        """Wrap the processing steps for S3 batch operations tasks Lambda invocations.
+    def iter_lines(self, bucket: str, file_path: str, etag: str = None):
+        """Yield the non-empty lines of a zipped file from S3, without their line terminator.
 
         Args:
-            event: The event passed on a S3 batch operations task.
-            pii_key: The key of values to be replaced by null values.
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the file to be read.
+            etag: The ETag the file should match. Defaults to None.
+        """
+        with self.open_object(bucket, file_path, etag) as obj, self.open_gzip(obj) as gzipfile:
+            yield from self.read_lines(gzipfile)
+
+    def read_lines(self, gzipfile):
+        """Yield the non-empty lines of a decompressed file, without their line terminator."""
+        for index, line in enumerate(gzipfile):
+            if index % TIME_BUDGET_CHECK_LINES == 0:
+                self.check_time_budget()
+            line = line.rstrip(b'\r\n')
+            if line.strip():
+                yield line
+
+    def read_chunks(self, gzipfile):
+        """Yield the content of a decompressed file in chunks ending on a line terminator."""
+        while True:
+            self.check_time_budget()
+            chunk = gzipfile.read(self.redaction_chunk_size)
+            if not chunk:
+                break
+            yield chunk + gzipfile.readline()
+
+    def iter_redacted_lines(self, bucket: str, file_path: str, etag: str = None):
+        """Yield the redacted lines of a zipped file from S3, in chunks of lines separated by commas
+        when the file is redacted by the pool of processes.
+
+        Only the files from redaction_min_size compressed bytes are sent to the pool,
+        the smaller ones being redacted by their thread.
+
+        Args:
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the file to be read.
+            etag: The ETag the file should match. Defaults to None.
         """
+        with self.open_object(bucket, file_path, etag) as obj, self.open_gzip(obj) as gzipfile:
+            if self.redaction_pool is None or obj.size < self.redaction_min_size:
+                for line in self.read_lines(gzipfile):
+                    yield self.redactor.redact_line(line)
+                return
+
+            # Closed right away when the file fails, to release the pool to the other files
+            with contextlib.closing(self.redaction_pool.map(self.read_chunks(gzipfile))) as results:
+                for lines in results:
+                    if lines:
+                        yield lines
+
+    def stream_file(self, bucket: str, file_path: str, replace=False, etag: str = None) -> None:
+        """Clean up a zipped file from S3 line by line and write it back to s3.
 
-        results = list()
+        The raw file is decompressed, redacted and recompressed one line at a time,
+        and uploaded in parts, so the memory used does not depend on its size. The
+        processed file holds the same JSON array as the one written by write_file,
+        with the lines free of PIIs copied as they are. With several redaction
+        workers, the file is decompressed and split into chunks of lines redacted
+        in parallel by a pool of processes, and reassembled in order.
+
+        Args:
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the file to be processed.
+            replace: Whether to remove the original file. Defaults to False.
+            etag: The ETag the raw file should match, stamped on the processed file. Defaults to None.
+        """
+        file_src_path = file_path
+        file_dst_path = self.get_destination_path(file_src_path)
+
+        metadata = self.get_output_metadata(etag)
+        with lambda_runtime.S3MultipartWriter(self.s3_client, bucket, file_dst_path, metadata=metadata) as writer:
+            with self.create_gzip(writer) as fh:
+                fh.write(b'[')
+                separator = b''
+                with contextlib.closing(self.iter_redacted_lines(bucket, file_src_path, etag)) as redacted_lines:
+                    for lines in redacted_lines:
+                        fh.write(separator)
+                        fh.write(lines)
+                        separator = b','
+                fh.write(b']')
+
+        if replace == True:
+            self.s3_client.delete_object(Bucket=bucket, Key=file_src_path)
+
+        return
+
+    def stream_parquet_file(self, bucket: str, file_path: str, replace=False, etag: str = None) -> None:
+        """Clean up a zipped file from S3 line by line and write it back to s3 as Parquet files.
+
+        Args:
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the file to be processed.
+            replace: Whether to remove the original file. Defaults to False.
+            etag: The ETag the raw file should match, stamped on the Parquet files. Defaults to None.
+        """
+        metadata = self.get_output_metadata(etag)
+        with SegmentParquetWriter(
+            self.s3_client, bucket, file_path, serializer=self.serializer, metadata=metadata
+        ) as writer:
+            for line in self.iter_lines(bucket, file_path, etag):
+                event = self.serializer.loads(line)
+                if self.redactor.may_hold_pii(line):
+                    self.redactor.redact_values(event, line.count(b'{') + line.count(b'['))
+                writer.write(event)
+
+        if replace == True:
+            self.s3_client.delete_object(Bucket=bucket, Key=file_path)
+
+        return
+
+    def audit_file(self, bucket: str, file_path: str) -> dict:
+        """Count the PII values of a zipped file from S3 per key path, without rewriting it.
+
+        The file is streamed line by line, the lines free of PII key patterns being
+        counted without being parsed, so the memory used does not depend on its size.
+        Past AUDIT_MAX_PATHS distinct paths, the values of the new paths are counted
+        under AUDIT_OTHER_PATH.
+
+        Args:
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the file to be audited.
+
+        Returns:
+            The audit record of the file, with its number of events, of events holding
+            PIIs and of PII values, and the number of PII values per key path.
+        """
+        events, events_with_pii = 0, 0
+        paths = collections.Counter()
+        for line in self.iter_lines(bucket, file_path):
+            events += 1
+            if not self.redactor.may_hold_pii(line):
+                continue
+            event_paths = self.redactor.find_paths(self.serializer.loads(line))
+            if event_paths:
+                events_with_pii += 1
+            for path in event_paths:
+                if path not in paths and len(paths) >= AUDIT_MAX_PATHS:
+                    path = AUDIT_OTHER_PATH
+                paths[path] += 1
+
+        return {
+            'bucket': bucket,
+            'key': file_path,
+            'events': events,
+            'events_with_pii': events_with_pii,
+            'pii_values': sum(paths.values()),
+            'paths': dict(paths.most_common()),
+        }
+
+    def audit_s3_object(self, bucket: str, file_path: str) -> dict:
+        """Audit a file and log its audit record or the potential errors.
+
+        Returns:
+            The audit record of the file, or None when it could not be audited.
+        """
+        try:
+            record = self.audit_file(bucket, file_path)
+            logger.info(json.dumps(record, separators=(',', ':')))
+            return record
+
+        except Exception:
+            # Log error traceback string
+            exception_type, exception_value, exception_traceback = sys.exc_info()
+            traceback_string = traceback.format_exception(
+                exception_type, exception_value, exception_traceback
+            )
+            err_msg = json.dumps({
+                "errorType": exception_type.__name__,
+                "errorMessage": str(exception_value),
+                "stackTrace": traceback_string
+            })
+            logger.error(err_msg)
+            return None
+
+    def audit_prefix(self, bucket: str, prefix: str = '', continuation_token: str = None) -> dict:
+        """Audit the raw files of a S3 prefix concurrently, one page of the listing at a time.
+
+        The audit stops before the next page when the invocation is about to time
+        out, and returns the token to resume it from.
+
+        Args:
+            bucket: The S3 bucket where the raw files are stored.
+            prefix: The prefix of the files to be audited. Defaults to ''.
+            continuation_token: The token of the page to resume the audit from. Defaults to None.
+
+        Returns:
+            The summary of the audit, with the totals of the audit records, the files
+            that could not be audited and the continuation token when the audit stopped
+            early.
+        """
+        summary = {
+            'bucket': bucket,
+            'prefix': prefix,
+            'objects': 0,
+            'events': 0,
+            'events_with_pii': 0,
+            'pii_values': 0,
+            'failed': list(),
+            'continuation_token': None,
+        }
+        paths = collections.Counter()
+
+        while True:
+            parameters = {'Bucket': bucket, 'Prefix': prefix}
+            if continuation_token is not None:
+                parameters['ContinuationToken'] = continuation_token
+            page = self.s3_client.list_objects_v2(**parameters)
+
+            file_paths = [obj['Key'] for obj in page.get('Contents', []) if obj['Key'].endswith('.gz')]
+            workers = max(1, min(self.max_workers, len(file_paths)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                records = executor.map(lambda file_path: self.audit_s3_object(bucket, file_path), file_paths)
+
+            for file_path, record in zip(file_paths, records):
+                if record is None:
+                    summary['failed'].append(file_path)
+                    continue
+                summary['objects'] += 1
+                for key in ('events', 'events_with_pii', 'pii_values'):
+                    summary[key] += record[key]
+                for path, count in record['paths'].items():
+                    if path not in paths and len(paths) >= AUDIT_MAX_PATHS:
+                        path = AUDIT_OTHER_PATH
+                    paths[path] += count
+
+            continuation_token = page.get('NextContinuationToken')
+            if not page.get('IsTruncated') or continuation_token is None:
+                break
+            if self.get_remaining_time() < 2 * TIME_BUDGET_MARGIN_MS:
+                summary['continuation_token'] = continuation_token
+                break
+
+        summary['paths'] = dict(paths.most_common())
+        return summary
+
+    def process_s3_batch_task(self, task: dict) -> dict:
+        """Process the file of a S3 batch operations task.
+
+        Args:
+            task: A task of the event passed on a S3 batch operations job.
+
+        Returns:
+            The result of the task in the S3 batch operations response format.
+        """
+        file_path = None
         try:
             # Get object attributes
-            file_path = event.get('tasks')[0].get('s3Key')[1:]
-            bucket = event.get('tasks')[0].get('s3BucketArn').split(':::')[-1]
+            file_path = urllib.parse.unquote_plus(task.get('s3Key')).lstrip('/')
+            bucket = task.get('s3Bucket') or task.get('s3BucketArn').split(':::')[-1]
             logger.info(f"Added file to S3 bucket {bucket}: {file_path}")
 
             # Process file
-            file_raw = self.download_file(bucket, file_path)
-            file_parsed = self.parse_file(file_raw)
-            file_cleaned = self.cleanup_file(pii_key, file_parsed)
-            self.write_file(bucket, file_path, file_cleaned, replace=True)
+            record = self.process_file(bucket, file_path)
 
-            # Set success parameters
+            # Set success parameters, with the audit record in dry-run mode for the job report
             result_code = 'Succeeded'
             result_string = f"Successfully parsed object {file_path}."
+            if record is not None:
+                result_string = json.dumps(record, separators=(',', ':'))
 
         except Exception as error:
 
-            # Mark all other exceptions as permanent failures.
-            result_code = 'PermanentFailure'
+            # Let S3 batch operations retry the tasks failing on throttling or timeouts,
+            # and mark all other exceptions as permanent failures.
+            result_code = 'TemporaryFailure' if is_transient_error(error) else 'PermanentFailure'
             result_string = str(error)
 
             # Logg error traceback string
@@ -173,14 +1768,31 @@ class JSONCleaner():
             logger.error(err_msg)
 
         finally:
-            results.append({
-                           'taskId': event['tasks'][0]['taskId'],
-                           'resultCode': result_code,
-                           'resultString': result_string
-                           })
             logger.info(f"Attempt to process {file_path} completed.")
             logger.info("-------------------------------------------------------------")
 
+        return {
+            'taskId': task['taskId'],
+            'resultCode': result_code,
+            'resultString': result_string
+        }
+
+    def process_s3_batch_operations(self, event: dict) -> dict:
+        """Wrap the processing steps for S3 batch operations tasks Lambda invocations.
+
+        All the tasks of the invocation are processed concurrently.
+
+        Args:
+            event: The event passed on a S3 batch operations task.
+
+        Returns:
+            The results of the tasks in the S3 batch operations response format.
+        """
+        tasks = event.get('tasks') or []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(tasks)))) as executor:
+            results = list(executor.map(self.process_s3_batch_task, tasks))
+
         return {
             'invocationSchemaVersion': event['invocationSchemaVersion'],
             'treatMissingKeysAs': 'PermanentFailure',
@@ -188,27 +1800,20 @@ class JSONCleaner():
             'results': results
         }
 
-    def process_s3_event_notifications(self, event: dict,  pii_key: str) -> None:
-        """Wrap the processing steps for S3 events notification Lambda invocations.
+    def process_s3_object(self, bucket: str, file_path: str, etag: str = None) -> bool:
+        """Process a file and log the potential errors.
 
         Args:
-            event: The event passed when Lambda is invoked by a S3 events notification.
-            pii_key: The key of values to be replaced by null values.
+            bucket: The S3 bucket where the raw files are stored.
+            file_path: The path of the file to be processed.
+            etag: The ETag of the file, when known from the event. Defaults to None.
 
         Returns:
-            None
+            Whether the file was processed successfully.
         """
         try:
-            # Get object attributes
-            file_path = event.get('Records')[0].get('s3').get('object').get('key')
-            bucket = event.get('Records')[0].get('s3').get('bucket').get('name')
             logger.info(f"Added file to S3 bucket {bucket}: {file_path}")
-
-            # Process file
-            file_raw = self.download_file(bucket, file_path)
-            file_parsed = self.parse_file(file_raw)
-            file_cleaned = self.cleanup_file(pii_key, file_parsed)
-            self.write_file(bucket, file_path, file_cleaned, replace=True)
+            self.process_file(bucket, file_path, etag)
             result = True
 
         except Exception:
@@ -231,9 +1836,95 @@ class JSONCleaner():
 
         return result
 
+    def process_s3_event_notifications(self, event: dict) -> list[dict]:
+        """Wrap the processing steps for S3 events notification Lambda invocations.
+
+        All the records of the notification are processed concurrently.
+
+        Args:
+            event: The event passed when Lambda is invoked by a S3 events notification.
+
+        Returns:
+            The bucket, key and success of each file of the notification.
+        """
+        objects = [self.get_notification_object(record) for record in event.get('Records')]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(objects)))) as executor:
+            succeeded = executor.map(lambda obj: self.process_s3_object(*obj), objects)
+
+        return [
+            {'bucket': bucket, 'key': file_path, 'succeeded': success}
+            for (bucket, file_path, _), success in zip(objects, succeeded)
+        ]
+
+    def get_notification_object(self, record: dict) -> tuple:
+        """Return the bucket, key and ETag of the object of a S3 event notification record."""
+        # The notifications give the ETag of the objects unquoted
+        etag = record['s3']['object'].get('eTag')
+        return (
+            record['s3']['bucket']['name'],
+            urllib.parse.unquote_plus(record['s3']['object']['key']),
+            f'"{etag}"' if etag else None
+        )
+
+    def get_sqs_message_objects(self, message: dict) -> list[tuple]:
+        """Return the objects of the S3 event notification carried by a SQS message.
+
+        The notification is either the body of the message, or the message of a SNS
+        notification when the bucket notifies a SNS topic the queue is subscribed to.
+        The test events sent by S3 when configuring the notifications hold no object.
+
+        Args:
+            message: A SQS message of the event.
+
+        Returns:
+            The bucket, key and ETag of each object of the notification.
+        """
+        body = json.loads(message['body'])
+        if 'Records' not in body and 'Message' in body:
+            body = json.loads(body['Message'])
+        return [
+            self.get_notification_object(record)
+            for record in body.get('Records', [])
+            if record.get('eventSource') == 'aws:s3' and record.get('eventName', '').startswith('ObjectCreated')
+        ]
+
+    def process_sqs_messages(self, event: dict) -> dict:
+        """Wrap the processing steps for SQS batches of S3 events notifications.
+
+        The objects of all the messages of the batch are processed concurrently, with
+        the clients of the invocation, and the messages with an object that failed are
+        reported so that only these messages are delivered again.
+
+        Args:
+            event: The event passed when Lambda is invoked by a SQS event source mapping.
+
+        Returns:
+            The identifiers of the failed messages in the SQS partial batch response format.
+        """
+        failures, objects = list(), list()
+        for message in event.get('Records'):
+            try:
+                objects.extend((message['messageId'], obj) for obj in self.get_sqs_message_objects(message))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                logger.error(f"Malformed S3 events notification in SQS message {message['messageId']}.")
+                failures.append(message['messageId'])
+
+        if objects:
+            workers = max(1, min(self.max_workers, len(objects)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                succeeded = list(executor.map(lambda obj: self.process_s3_object(*obj[1]), objects))
+
+            for (message_id, _), success in zip(objects, succeeded):
+                if not success and message_id not in failures:
+                    failures.append(message_id)
+
+        return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+
 
 def lambda_handler(event, context):
-    """Scans the file in a bucket and replace IPs with None values."""
+    """Scans the file in a bucket and replace PIIs with None values."""
+    lambda_runtime.log_cold_start()
     logger.info("-------------------------------------------------------------")
     logger.info(f"Lambda function ARN: {context.invoked_function_arn}")
     logger.info(f"CloudWatch log stream name: {context.log_stream_name}")
@@ -241,19 +1932,52 @@ def lambda_handler(event, context):
     logger.info(f"Lambda Request ID: {context.aws_request_id}")
     logger.info(f"Lambda function memory limits in MB: {context.memory_limit_in_mb}")
 
-    helper = JSONCleaner()
+    download_part_size = int(os.environ.get('download_part_size', DOWNLOAD_PART_SIZE))
+    download_concurrency = int(os.environ.get('download_concurrency', DOWNLOAD_CONCURRENCY))
+    worker_memory_mb = WORKER_MEMORY_MB + (download_concurrency + 1) * download_part_size // 2**20
+    max_workers = get_pool_size(context.memory_limit_in_mb, worker_memory_mb)
+    json_backend = os.environ.get('json_backend', 'auto')
 
-    pii_fields = ['ip', 'account', 'parent_account']
+    redaction_workers = 1
+    if os.environ.get('process_pool', 'false') == 'true':
+        redaction_workers = get_redaction_pool_size(context.memory_limit_in_mb)
+    # The redaction processes are forked before the threads of the invocation start, and shared by its files
+    redaction_pool = RedactionPool(PII_FIELDS, json_backend, redaction_workers) if redaction_workers > 1 else None
 
-    for field in pii_fields:
+    with redaction_pool or contextlib.nullcontext():
+        helper = JSONCleaner(
+            PII_FIELDS,
+            streaming=os.environ.get('streaming', 'true') == 'true',
+            max_workers=max_workers,
+            context=context,
+            compression_level=int(os.environ.get('compression_level', COMPRESSION_LEVEL)),
+            compression_workers=int(os.environ.get('compression_workers', os.cpu_count() or 1)),
+            download_part_size=download_part_size,
+            download_concurrency=download_concurrency,
+            output_format=os.environ.get('output_format', 'json'),
+            dry_run=os.environ.get('dry_run', 'false') == 'true',
+            json_backend=json_backend,
+            redaction_pool=redaction_pool,
+            redaction_chunk_size=get_redaction_chunk_size(context.memory_limit_in_mb, redaction_workers, max_workers)
+        )
 
         if event.get('invocationSchemaVersion'):
             logger.info(f'S3 batch operations task: {event}')
-            event = helper.process_s3_batch_operations(event, field)
+            result = helper.process_s3_batch_operations(event)
+
+        elif event.get('Records') and event['Records'][0].get('eventSource') == 'aws:sqs':
+            logger.info(f"SQS batch of {len(event['Records'])} S3 events notifications.")
+            result = helper.process_sqs_messages(event)
 
         elif event.get('Records'):
             logger.info(f'S3 events notification: {event}')
-            event = helper.process_s3_event_notifications(event, field)
+            result = helper.process_s3_event_notifications(event)
+
+        elif event.get('audit'):
+            logger.info(f'PII audit of a S3 prefix: {event}')
+            result = helper.audit_prefix(
+                event['audit']['bucket'], event['audit'].get('prefix', ''), event['audit'].get('continuation_token')
+            )
 
         else:
             logger.info("Unrecognized event payload. This seems to be neither "
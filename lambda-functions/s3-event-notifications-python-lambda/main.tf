@@ -2,8 +2,16 @@ provider "archive" {}
 
 data "archive_file" "zip" {
   type        = "zip"
-  source_file = "${path.module}/lambda/${var.function_name}.py"
   output_path = "${path.module}/lambda/${var.function_name}.zip"
+  source {
+    content  = file("${path.module}/lambda/${var.function_name}.py")
+    filename = "${var.function_name}.py"
+  }
+  # The runtime module shared by the Lambda functions
+  source {
+    content  = file("${path.module}/../shared/lambda_runtime.py")
+    filename = "lambda_runtime.py"
+  }
 }
 
 resource "aws_lambda_function" "lambda" {
@@ -16,10 +24,25 @@ resource "aws_lambda_function" "lambda" {
   handler = "${var.function_name}.lambda_handler"
   runtime = "python3.9"
 
+  layers                         = var.layers
   memory_size                    = var.memory_size
   timeout                        = var.timeout
   # reserved_concurrent_executions = var.concurrent_executions
 
+  environment {
+    variables = {
+      streaming            = var.streaming
+      compression_level    = var.compression_level
+      download_part_size   = var.download_part_size
+      download_concurrency = var.download_concurrency
+      output_format        = var.output_format
+      json_backend         = var.json_backend
+      process_pool         = var.process_pool
+      dry_run              = var.dry_run
+      profile_imports      = var.profile_imports
+    }
+  }
+
   tags = {
     Name        = "${var.namespace}-${var.function_name}-desktop-bucket-${var.environment}"
     Environment = var.environment
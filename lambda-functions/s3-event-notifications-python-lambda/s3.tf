@@ -24,12 +24,25 @@ resource "aws_lambda_permission" "allow_desktop_bucket" {
 # Create the S3 event notifications
 resource "aws_s3_bucket_notification" "desktop" {
   bucket = aws_s3_bucket.desktop.id
-  lambda_function {
-    lambda_function_arn = aws_lambda_function.lambda.arn
-    events              = ["s3:ObjectCreated:*"]
-    filter_suffix       = ".gz"
+  # Invoke the lambda function with each notification
+  dynamic "lambda_function" {
+    for_each = var.sqs_batching ? [] : [aws_lambda_function.lambda.arn]
+    content {
+      lambda_function_arn = lambda_function.value
+      events              = ["s3:ObjectCreated:*"]
+      filter_suffix       = ".gz"
+    }
   }
-  depends_on = [aws_lambda_permission.allow_desktop_bucket]
+  # Or send them to the queue batching them for the lambda function
+  dynamic "queue" {
+    for_each = aws_sqs_queue.notifications
+    content {
+      queue_arn     = queue.value.arn
+      events        = ["s3:ObjectCreated:*"]
+      filter_suffix = ".gz"
+    }
+  }
+  depends_on = [aws_lambda_permission.allow_desktop_bucket, aws_sqs_queue_policy.notifications]
 }
 
 # MOBILE BUCKET
@@ -58,10 +71,23 @@ resource "aws_lambda_permission" "allow_mobile_bucket" {
 # Create the S3 event notifications
 resource "aws_s3_bucket_notification" "mobile" {
   bucket = aws_s3_bucket.mobile.id
-  lambda_function {
-    lambda_function_arn = aws_lambda_function.lambda.arn
-    events              = ["s3:ObjectCreated:*"]
-    filter_suffix       = ".gz"
+  # Invoke the lambda function with each notification
+  dynamic "lambda_function" {
+    for_each = var.sqs_batching ? [] : [aws_lambda_function.lambda.arn]
+    content {
+      lambda_function_arn = lambda_function.value
+      events              = ["s3:ObjectCreated:*"]
+      filter_suffix       = ".gz"
+    }
+  }
+  # Or send them to the queue batching them for the lambda function
+  dynamic "queue" {
+    for_each = aws_sqs_queue.notifications
+    content {
+      queue_arn     = queue.value.arn
+      events        = ["s3:ObjectCreated:*"]
+      filter_suffix = ".gz"
+    }
   }
-  depends_on = [aws_lambda_permission.allow_mobile_bucket]
+  depends_on = [aws_lambda_permission.allow_mobile_bucket, aws_sqs_queue_policy.notifications]
 }
@@ -0,0 +1,361 @@
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_PATH)
+sys.path.insert(0, os.path.join(SCRIPTS_PATH, '..', 'lambda'))
+sys.path.insert(0, os.path.join(SCRIPTS_PATH, '..', '..', 'shared'))
+
+from local_s3 import InMemoryS3Client  # noqa: E402
+
+BUCKET = 'benchmark'
+FILE_PATH = 'segment/benchmark.gz'
+STAGES = ['download', 'parse', 'cleanup', 'write']
+STRATEGIES = ['legacy', 'streaming', 'parquet']
+# Words free of the PII key patterns, so that only the PII density drives the redaction
+WORDS = ['name', 'value', 'path', 'title', 'url', 'referrer', 'search', 'category', 'price', 'quantity',
+         'currency', 'label', 'color', 'size', 'brand', 'variant', 'position', 'coupon', 'revenue', 'total']
+EVENT_TYPES = ['track', 'identify', 'page', 'screen']
+
+
+def generate_properties(rng: random.Random, depth: int) -> dict:
+    """Generate the nested properties of a synthetic event."""
+    properties = {rng.choice(WORDS): rng.choice([rng.random(), rng.randint(0, 10**6), rng.choice(WORDS), True])
+                  for _ in range(rng.randint(3, 8))}
+    if depth > 1:
+        properties[rng.choice(WORDS) + '_details'] = generate_properties(rng, depth - 1)
+        properties[rng.choice(WORDS) + '_items'] = [generate_properties(rng, depth - 1) for _ in range(2)]
+    return properties
+
+
+def generate_event(rng: random.Random, index: int, depth: int, pii_density: float) -> dict:
+    """Generate a synthetic Segment-like event.
+
+    Args:
+        rng: The random generator.
+        index: The position of the event in the file.
+        depth: The nesting depth of the event properties.
+        pii_density: The share of events holding PII keys.
+
+    Returns:
+        The event.
+    """
+    event = {
+        'type': rng.choice(EVENT_TYPES),
+        'event': rng.choice(WORDS).title(),
+        'messageId': f'{rng.getrandbits(128):032x}',
+        'anonymousId': f'{rng.getrandbits(64):016x}',
+        'timestamp': f'2022-01-01T00:00:{index % 60:02d}.000Z',
+        'context': {
+            'library': {'name': 'analytics.js', 'version': '4.1.0'},
+            'locale': 'en-US',
+            'page': {'path': '/' + rng.choice(WORDS), 'title': rng.choice(WORDS)},
+        },
+        'properties': generate_properties(rng, depth),
+    }
+    if rng.random() < pii_density:
+        event['context']['ip'] = f'10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)}'
+        event['properties']['accountId'] = f'{rng.getrandbits(32):08x}'
+        event['properties']['parent_account'] = {'id': rng.randint(0, 10**6)}
+    return event
+
+
+def generate_file(path: str, size_mb: int, depth: int, pii_density: float, seed: int) -> None:
+    """Write a synthetic Segment gzip NDJSON file of about size_mb uncompressed MB.
+
+    Args:
+        path: The local path of the file.
+        size_mb: The uncompressed size of the file in MB.
+        depth: The nesting depth of the event properties.
+        pii_density: The share of events holding PII keys.
+        seed: The seed of the random generator.
+    """
+    rng = random.Random(seed)
+    size, index = 0, 0
+    with gzip.open(path + '.tmp', 'wb', compresslevel=6) as fh:
+        while size < size_mb * 2**20:
+            line = json.dumps(generate_event(rng, index, depth, pii_density)).encode('utf-8') + b'\n'
+            fh.write(line)
+            size += len(line)
+            index += 1
+    os.replace(path + '.tmp', path)
+
+
+def get_file(cache_dir: str, size_mb: int, depth: int, pii_density: float, seed: int) -> str:
+    """Return the path of a synthetic file, generating it when it is not cached."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'segment-{size_mb}mb-depth{depth}-pii{pii_density}-seed{seed}.gz')
+    if not os.path.exists(path):
+        print(f"Generating {path}")
+        generate_file(path, size_mb, depth, pii_density, seed)
+    return path
+
+
+def run_stages(cleaner, strategy: str, last_stage: str) -> int:
+    """Run the stages of a strategy up to last_stage.
+
+    Returns:
+        The number of events read, or None when the stages don't count them.
+    """
+    stages = STAGES[:STAGES.index(last_stage) + 1]
+
+    if strategy == 'legacy':
+        content = cleaner.download_file(BUCKET, FILE_PATH)
+        if 'parse' not in stages:
+            return content.count(b'\n')
+        events = cleaner.parse_file(content)
+        del content
+        if 'cleanup' in stages:
+            events = cleaner.cleanup_file(events)
+        if 'write' in stages:
+            cleaner.write_file(BUCKET, FILE_PATH, events)
+        return len(events)
+
+    if 'write' in stages:
+        if strategy == 'parquet':
+            cleaner.stream_parquet_file(BUCKET, FILE_PATH)
+        else:
+            cleaner.stream_file(BUCKET, FILE_PATH)
+        return None
+
+    count = 0
+    redactor = cleaner.redactor
+    for line in cleaner.iter_lines(BUCKET, FILE_PATH):
+        if stages[-1] == 'parse' and redactor.may_hold_pii(line):
+            cleaner.serializer.loads(line)
+        elif stages[-1] == 'cleanup':
+            redactor.redact_line(line)
+        count += 1
+    return count
+
+
+def measure(path: str, strategy: str, last_stage: str, options: dict, results) -> None:
+    """Run the stages of a strategy in a fresh process and report its duration and peak RSS."""
+    import lambda_function
+
+    s3_client = InMemoryS3Client()
+    with open(path, 'rb') as fh:
+        s3_client.put(BUCKET, FILE_PATH, fh.read())
+
+    # The pool is started before the cleaner, as by the Lambda function, and redacts the file whatever its size
+    options = dict(options)
+    redaction_workers = options.pop('redaction_workers', 1)
+    redaction_pool = None
+    if redaction_workers > 1:
+        redaction_pool = lambda_function.RedactionPool(
+            lambda_function.PII_FIELDS, options.get('json_backend', 'auto'), redaction_workers
+        )
+    cleaner = lambda_function.JSONCleaner(
+        lambda_function.PII_FIELDS,
+        streaming=strategy != 'legacy',
+        output_format='parquet' if strategy == 'parquet' else 'json',
+        redaction_pool=redaction_pool,
+        redaction_min_size=0,
+        **options
+    )
+    cleaner.s3_client = s3_client
+
+    base_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    events = run_stages(cleaner, strategy, last_stage)
+    seconds = time.perf_counter() - start
+    if redaction_pool is not None:
+        redaction_pool.close()
+
+    results.put({
+        'seconds': seconds,
+        'events': events,
+        'base_rss_mb': base_rss_mb,
+        # The redaction processes report the peak RSS of the largest one
+        'peak_rss_mb': max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        ) / 1024
+    })
+
+
+def run_process(path: str, strategy: str, last_stage: str, options: dict) -> dict:
+    """Run the stages of a strategy up to last_stage in a fresh process."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(path, strategy, last_stage, options, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"The {strategy} run up to the {last_stage} stage failed.")
+    return results.get()
+
+
+def summarize(strategy: str, size_mb: int, stage: str, seconds: float, events: int, result: dict) -> dict:
+    """Build the measures of a stage, leaving out the throughputs of stages too short to be measured."""
+    return {
+        'strategy': strategy,
+        'size_mb': size_mb,
+        'stage': stage,
+        'seconds': round(seconds, 4),
+        'mb_per_s': round(size_mb / seconds, 2) if seconds > 0 else None,
+        'events_per_s': round(events / seconds) if seconds > 0 else None,
+        'base_rss_mb': round(result['base_rss_mb'], 1),
+        'peak_rss_mb': round(result['peak_rss_mb'], 1),
+    }
+
+
+def benchmark(path: str, size_mb: int, strategy: str, options: dict, repeat: int = 1) -> list[dict]:
+    """Measure the throughput and peak RSS of each stage of a strategy on a file.
+
+    Each run executes the stages up to the measured one in a fresh process, the
+    duration of a stage being the difference with the fastest run stopping at the
+    previous stage, or 0 when the stage is too short to be measured above the
+    noise. The streaming stages overlap, so their peak RSS is the one of the whole
+    pipeline up to the stage.
+
+    Returns:
+        The measures of each stage, and of the whole pipeline.
+    """
+    measures, previous_seconds, events = list(), 0, None
+    for stage in STAGES:
+        runs = [run_process(path, strategy, stage, options) for _ in range(repeat)]
+        result = min(runs, key=lambda run: run['seconds'])
+        result['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+
+        events = events or result['events']
+        seconds = max(0.0, result['seconds'] - previous_seconds)
+        measures.append(summarize(strategy, size_mb, stage, seconds, events, result))
+        previous_seconds = max(previous_seconds, result['seconds'])
+
+    measures.append(summarize(strategy, size_mb, 'total', previous_seconds, events, result))
+    return measures
+
+
+def check_backends(path: str, options: dict, results) -> None:
+    """Process a file with each installed JSON backend and compare the processed files, in a fresh process.
+
+    The backends may format some numbers differently, so the processed files are
+    compared once parsed. The check runs in its own process, since the processes
+    of the measures inherit the peak RSS of the benchmark process.
+
+    Puts in results the description of the processed files differing from the ones of the standard library.
+    """
+    import lambda_function
+
+    backends = ['json'] + (['orjson'] if lambda_function.orjson is not None else [])
+    outputs, differences = dict(), list()
+    for streaming in (False, True):
+        for backend in backends:
+            s3_client = InMemoryS3Client()
+            with open(path, 'rb') as fh:
+                s3_client.put(BUCKET, FILE_PATH, fh.read())
+            cleaner = lambda_function.JSONCleaner(
+                lambda_function.PII_FIELDS, streaming=streaming, json_backend=backend, **options
+            )
+            cleaner.s3_client = s3_client
+            cleaner.process_file(BUCKET, FILE_PATH)
+            output = s3_client.get_object(Bucket=BUCKET, Key=cleaner.get_destination_path(FILE_PATH))['Body']
+            outputs[(streaming, backend)] = json.loads(gzip.decompress(output.read()))
+
+    reference = outputs[(False, 'json')]
+    for (streaming, backend), output in outputs.items():
+        if output != reference:
+            differences.append(f"{'streaming' if streaming else 'legacy'} {backend} differs from legacy json")
+    print(f"Compared the processed files of the {', '.join(backends)} backends")
+    results.put(differences)
+
+
+def run_check_backends(path: str, options: dict) -> list[str]:
+    """Compare the processed files of the JSON backends in a fresh process."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=check_backends, args=(path, options, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("The check of the JSON backends failed.")
+    return results.get()
+
+
+def find_regressions(measures: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """Compare the total throughput of each strategy and size with a baseline.
+
+    Returns:
+        The description of the throughputs below the baseline by more than the tolerance.
+    """
+    reference = {(m['strategy'], m['size_mb']): m for m in baseline if m['stage'] == 'total'}
+    regressions = list()
+    for m in measures:
+        base = reference.get((m['strategy'], m['size_mb']))
+        if m['stage'] != 'total' or base is None:
+            continue
+        if m['mb_per_s'] is not None and m['mb_per_s'] < base['mb_per_s'] * (1 - tolerance):
+            regressions.append(
+                f"{m['strategy']} {m['size_mb']} MB: {m['mb_per_s']} MB/s against {base['mb_per_s']} MB/s"
+            )
+    return regressions
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measure the throughput and memory of the JSONCleaner stages.")
+    parser.add_argument('--sizes', default='1,10,100,1000', help="The uncompressed sizes of the files in MB.")
+    parser.add_argument('--depth', type=int, default=3, help="The nesting depth of the event properties.")
+    parser.add_argument('--pii-density', type=float, default=0.1, help="The share of events holding PIIs.")
+    parser.add_argument('--seed', type=int, default=0, help="The seed of the synthetic files.")
+    parser.add_argument('--strategies', default='legacy,streaming', help=f"Among {', '.join(STRATEGIES)}.")
+    parser.add_argument('--repeat', type=int, default=3, help="The number of runs of each stage.")
+    parser.add_argument('--compression-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--compression-level', type=int, default=6)
+    parser.add_argument('--json-backend', default='auto', help="Among auto, json, orjson.")
+    parser.add_argument('--redaction-workers', type=int, default=1,
+                        help="The number of processes redacting the streamed files.")
+    parser.add_argument('--check-backends', action='store_true',
+                        help="Check that the JSON backends write the same processed files.")
+    parser.add_argument('--cache-dir', default=os.path.join(SCRIPTS_PATH, '.benchmark'))
+    parser.add_argument('--output', help="The path of the JSON file where to write the measures.")
+    parser.add_argument('--baseline', help="The path of the measures to compare the throughputs with.")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="The accepted throughput decrease.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    arguments = parse_arguments()
+    options = {
+        'compression_workers': arguments.compression_workers,
+        'compression_level': arguments.compression_level,
+    }
+
+    if arguments.check_backends:
+        path = get_file(arguments.cache_dir, 1, arguments.depth, arguments.pii_density, arguments.seed)
+        differences = run_check_backends(path, options)
+        for difference in differences:
+            print(f"Backend mismatch: {difference}")
+        if differences:
+            sys.exit(1)
+    options['json_backend'] = arguments.json_backend
+    options['redaction_workers'] = arguments.redaction_workers
+
+    measures = list()
+    for size_mb in [int(size) for size in arguments.sizes.split(',')]:
+        path = get_file(arguments.cache_dir, size_mb, arguments.depth, arguments.pii_density, arguments.seed)
+        for strategy in arguments.strategies.split(','):
+            for m in benchmark(path, size_mb, strategy, options, arguments.repeat):
+                print(f"{m['strategy']:>10} {m['size_mb']:>6} MB {m['stage']:>8}: {m['seconds']:>9.3f} s "
+                      f"{m['mb_per_s'] or '-':>9} MB/s {m['events_per_s'] or '-':>9} events/s "
+                      f"{m['peak_rss_mb']:>8.1f} MB peak RSS ({m['base_rss_mb']:.1f} MB before)")
+                measures.append(m)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(measures, f, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as f:
+            regressions = find_regressions(measures, json.load(f), arguments.tolerance)
+        for regression in regressions:
+            print(f"Throughput regression: {regression}")
+        sys.exit(1 if regressions else 0)
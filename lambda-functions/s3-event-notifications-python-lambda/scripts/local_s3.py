@@ -0,0 +1,106 @@
+import io
+import hashlib
+import itertools
+import threading
+
+from botocore.exceptions import ClientError
+
+
+class InMemoryS3Client():
+    """In-process stand-in for the subset of the boto3 S3 client used by the Lambda function.
+
+    The objects are kept in memory, so that the Lambda function can be run and
+    measured locally without network nor AWS credentials.
+    """
+    def __init__(self):
+        self.objects = dict()
+        self.uploads = dict()
+        self.upload_ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def error(self, code: str, status_code: int, operation: str) -> ClientError:
+        """Build the error raised by boto3 for a failed request."""
+        return ClientError(
+            {'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status_code}},
+            operation
+        )
+
+    def get(self, bucket: str, key: str, operation: str, if_match: str = None) -> dict:
+        """Return a stored object or raise the error of a missing key or of another ETag."""
+        with self.lock:
+            obj = self.objects.get((bucket, key))
+        if obj is None:
+            # HEAD responses have no body, so their errors only hold the status code
+            raise self.error('404' if operation == 'HeadObject' else 'NoSuchKey', 404, operation)
+        if if_match is not None and if_match.strip('"') != obj['ETag'].strip('"'):
+            raise self.error('PreconditionFailed', 412, operation)
+        return obj
+
+    def put(self, bucket: str, key: str, body: bytes, metadata: dict = None) -> dict:
+        """Store an object."""
+        obj = {
+            'Body': bytes(body),
+            'ETag': f'"{hashlib.md5(body).hexdigest()}"',
+            'Metadata': dict(metadata or {})
+        }
+        with self.lock:
+            self.objects[(bucket, key)] = obj
+        return obj
+
+    def head_object(self, Bucket: str, Key: str, IfMatch: str = None, **kwargs) -> dict:
+        obj = self.get(Bucket, Key, 'HeadObject', IfMatch)
+        return {'ETag': obj['ETag'], 'ContentLength': len(obj['Body']), 'Metadata': obj['Metadata']}
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None, IfMatch: str = None, **kwargs) -> dict:
+        obj = self.get(Bucket, Key, 'GetObject', IfMatch)
+
+        body = obj['Body']
+        response = {'ETag': obj['ETag'], 'Metadata': obj['Metadata']}
+        if Range is not None:
+            start, end = Range.split('=')[1].split('-')
+            start, end = int(start), min(int(end), len(body) - 1)
+            if start >= len(body):
+                raise self.error('InvalidRange', 416, 'GetObject')
+            response['ContentRange'] = f'bytes {start}-{end}/{len(body)}'
+            body = body[start:end + 1]
+        response['ContentLength'] = len(body)
+        response['Body'] = io.BytesIO(body)
+        return response
+
+    def put_object(self, Bucket: str, Key: str, Body, Metadata: dict = None, **kwargs) -> dict:
+        body = Body.read() if hasattr(Body, 'read') else Body
+        return {'ETag': self.put(Bucket, Key, body, Metadata)['ETag']}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', ContinuationToken: str = None, **kwargs) -> dict:
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        contents = [{'Key': key, 'Size': len(self.objects[(Bucket, key)]['Body'])} for key in keys]
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, Metadata: dict = None, **kwargs) -> dict:
+        upload_id = str(next(self.upload_ids))
+        with self.lock:
+            self.uploads[upload_id] = {'Parts': dict(), 'Metadata': Metadata}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body, **kwargs) -> dict:
+        body = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        with self.lock:
+            self.uploads[UploadId]['Parts'][PartNumber] = body
+        return {'ETag': f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict, **kwargs) -> dict:
+        with self.lock:
+            upload = self.uploads.pop(UploadId)
+        body = b''.join(upload['Parts'][part['PartNumber']] for part in MultipartUpload['Parts'])
+        return {'ETag': self.put(Bucket, Key, body, upload['Metadata'])['ETag']}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+        return {}
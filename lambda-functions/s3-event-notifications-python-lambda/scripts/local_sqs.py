@@ -0,0 +1,163 @@
+import argparse
+import collections
+import gzip
+import itertools
+import json
+import os
+import sys
+import time
+import uuid
+
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_PATH)
+sys.path.insert(0, os.path.join(SCRIPTS_PATH, '..', 'lambda'))
+sys.path.insert(0, os.path.join(SCRIPTS_PATH, '..', '..', 'shared'))
+
+from local_s3 import InMemoryS3Client  # noqa: E402
+
+BUCKET = 'segment'
+EVENT_SOURCE_ARN = 'arn:aws:sqs:us-east-1:000000000000:s3-event-notifications'
+
+
+class InMemorySQSQueue():
+    """In-process stand-in for a SQS queue polled by a Lambda event source mapping.
+
+    The messages that are not deleted are received again, up to the maximum receive
+    count after which they are moved to the dead-letter queue, as with a redrive policy.
+    """
+    def __init__(self, max_receive_count: int = 5):
+        self.max_receive_count = max_receive_count
+        self.messages = collections.OrderedDict()
+        self.dead_letters = list()
+
+    def send_message(self, body: str) -> str:
+        message_id = str(uuid.uuid4())
+        self.messages[message_id] = {'messageId': message_id, 'body': body, 'receiveCount': 0}
+        return message_id
+
+    def send_s3_notification(self, bucket: str, key: str, etag: str) -> str:
+        """Send the S3 event notification of a created object, with its ETag unquoted as S3 does."""
+        return self.send_message(json.dumps({'Records': [{
+            'eventSource': 'aws:s3',
+            'eventName': 'ObjectCreated:Put',
+            's3': {'bucket': {'name': bucket}, 'object': {'key': key, 'eTag': etag.strip('"')}}
+        }]}))
+
+    def receive_batch(self, batch_size: int) -> dict:
+        """Return the Lambda event of the next batch of messages."""
+        records = list()
+        for message in itertools.islice(self.messages.values(), batch_size):
+            message['receiveCount'] += 1
+            records.append({
+                'messageId': message['messageId'],
+                'receiptHandle': message['messageId'],
+                'body': message['body'],
+                'attributes': {'ApproximateReceiveCount': str(message['receiveCount'])},
+                'eventSource': 'aws:sqs',
+                'eventSourceARN': EVENT_SOURCE_ARN
+            })
+        return {'Records': records}
+
+    def complete_batch(self, event: dict, response: dict) -> None:
+        """Delete the succeeded messages of a batch, and redrive the failed ones."""
+        failures = {failure['itemIdentifier'] for failure in response.get('batchItemFailures', [])}
+        for record in event['Records']:
+            message = self.messages.pop(record['messageId'])
+            if record['messageId'] not in failures:
+                continue
+            if message['receiveCount'] >= self.max_receive_count:
+                self.dead_letters.append(message)
+            else:
+                # Received again once the visibility timeout has expired
+                self.messages[record['messageId']] = message
+
+
+class LambdaContext():
+    """Minimal Lambda context for local invocations."""
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:000000000000:function:s3-event-notifications'
+    log_stream_name = 'local'
+    log_group_name = 'local'
+    aws_request_id = 'local'
+
+    def __init__(self, memory_limit_in_mb: int, timeout: int):
+        self.memory_limit_in_mb = memory_limit_in_mb
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.deadline - time.time()) * 1000))
+
+
+def generate_object(index: int, events: int) -> bytes:
+    """Generate a small Segment file of identify events."""
+    lines = [
+        json.dumps({
+            'type': 'identify',
+            'messageId': f'{index}-{event}',
+            'traits': {'email': f'user{event}@example.com', 'plan': 'free', 'address': {'city': 'Paris'}},
+            'context': {'ip': '127.0.0.1', 'library': {'name': 'analytics.js'}}
+        })
+        for event in range(events)
+    ]
+    return gzip.compress('\n'.join(lines).encode())
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Run the S3 cleaner on SQS batches of S3 events notifications against in-memory S3 and SQS.'
+    )
+    parser.add_argument('--objects', type=int, default=200, help='Number of objects to create.')
+    parser.add_argument('--events', type=int, default=50, help='Number of events per object.')
+    parser.add_argument('--missing', type=int, default=0, help='Number of notifications of missing objects.')
+    parser.add_argument('--batch-size', type=int, default=100, help='Maximum number of messages per invocation.')
+    parser.add_argument('--max-receive-count', type=int, default=5, help='Receives before the dead-letter queue.')
+    parser.add_argument('--memory', type=int, default=2048, help='Lambda memory in MB.')
+    parser.add_argument('--timeout', type=int, default=300, help='Lambda timeout in seconds.')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_arguments()
+
+    import lambda_function
+
+    s3_client = InMemoryS3Client()
+    queue = InMemorySQSQueue(args.max_receive_count)
+    for index in range(args.objects):
+        key = f'segment-logs/source/{index}.gz'
+        obj = s3_client.put(BUCKET, key, generate_object(index, args.events))
+        queue.send_s3_notification(BUCKET, key, obj['ETag'])
+    for index in range(args.missing):
+        queue.send_s3_notification(BUCKET, f'segment-logs/source/missing-{index}.gz', '0')
+
+    # Every invocation builds its cleaner, which is given the in-memory client instead of its boto3 one
+    cleaner_init = lambda_function.JSONCleaner.__init__
+
+    def init_with_local_client(self, *args, **kwargs):
+        cleaner_init(self, *args, **kwargs)
+        self.s3_client = s3_client
+
+    lambda_function.JSONCleaner.__init__ = init_with_local_client
+
+    invocations = 0
+    start = time.perf_counter()
+    while queue.messages:
+        event = queue.receive_batch(args.batch_size)
+        response = lambda_function.lambda_handler(event, LambdaContext(args.memory, args.timeout))
+        queue.complete_batch(event, response)
+        invocations += 1
+    seconds = time.perf_counter() - start
+
+    cleaned = sum(1 for _, key in s3_client.objects if not key.endswith('.gz'))
+    print(json.dumps({
+        'objects': args.objects,
+        'batch_size': args.batch_size,
+        'invocations': invocations,
+        'cleaned': cleaned,
+        'dead_letters': len(queue.dead_letters),
+        'seconds': round(seconds, 3),
+        'objects_per_second': round(args.objects / seconds, 1) if seconds else None
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# SQS BATCHING
+# Create the queue buffering the S3 event notifications, so that the Lambda function
+# processes the small files written by Segment in batches rather than one per invocation
+resource "aws_sqs_queue" "notifications_dlq" {
+  count                     = var.sqs_batching ? 1 : 0
+  name                      = "${var.namespace}-${var.function_name}-notifications-dlq-${var.environment}"
+  message_retention_seconds = 1209600
+  tags = {
+    Name        = "${var.namespace}-${var.function_name}-notifications-dlq-${var.environment}"
+    Environment = var.environment
+    Project     = var.namespace
+  }
+}
+resource "aws_sqs_queue" "notifications" {
+  count = var.sqs_batching ? 1 : 0
+  name  = "${var.namespace}-${var.function_name}-notifications-${var.environment}"
+  # AWS recommends 6 times the function timeout, for the retries of throttled invocations
+  visibility_timeout_seconds = 6 * var.timeout
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.notifications_dlq[0].arn
+    maxReceiveCount     = var.sqs_max_receive_count
+  })
+  tags = {
+    Name        = "${var.namespace}-${var.function_name}-notifications-${var.environment}"
+    Environment = var.environment
+    Project     = var.namespace
+  }
+}
+# Grant the permission to send the S3 event notifications to the queue
+data "aws_iam_policy_document" "policy_sqs_notifications" {
+  count = var.sqs_batching ? 1 : 0
+  statement {
+    effect = "Allow"
+    principals {
+      identifiers = ["s3.amazonaws.com"]
+      type        = "Service"
+    }
+    actions   = ["sqs:SendMessage"]
+    resources = [aws_sqs_queue.notifications[0].arn]
+    condition {
+      test     = "ArnEquals"
+      variable = "aws:SourceArn"
+      values = [
+        aws_s3_bucket.mobile.arn,
+        aws_s3_bucket.desktop.arn
+      ]
+    }
+  }
+}
+resource "aws_sqs_queue_policy" "notifications" {
+  count     = var.sqs_batching ? 1 : 0
+  queue_url = aws_sqs_queue.notifications[0].id
+  policy    = data.aws_iam_policy_document.policy_sqs_notifications[0].json
+}
+# Invoke the lambda function with batches of notifications, only the failed ones being received again
+resource "aws_lambda_event_source_mapping" "notifications" {
+  count                              = var.sqs_batching ? 1 : 0
+  event_source_arn                   = aws_sqs_queue.notifications[0].arn
+  function_name                      = aws_lambda_function.lambda.arn
+  batch_size                         = var.sqs_batch_size
+  maximum_batching_window_in_seconds = var.sqs_batching_window
+  function_response_types            = ["ReportBatchItemFailures"]
+}
@@ -0,0 +1,41 @@
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', 'scripts'))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', 'lambda'))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', '..', 'shared'))
+
+import lambda_function  # noqa: E402
+from local_s3 import InMemoryS3Client  # noqa: E402
+
+BUCKET = 'segment'
+
+
+def gzip_events(events: list) -> bytes:
+    """Return the gzipped NDJSON content of a raw file of events."""
+    return gzip.compress(b''.join(json.dumps(event).encode() + b'\n' for event in events))
+
+
+def read_events(content: bytes) -> list:
+    """Return the events of a processed file, a gzipped JSON array."""
+    return json.loads(gzip.decompress(content))
+
+
+@pytest.fixture
+def s3_client() -> InMemoryS3Client:
+    return InMemoryS3Client()
+
+
+@pytest.fixture
+def make_cleaner(s3_client):
+    """Return a factory of JSONCleaner instances using the in-memory S3 client."""
+    def make(**kwargs) -> lambda_function.JSONCleaner:
+        cleaner = lambda_function.JSONCleaner(**kwargs)
+        cleaner.s3_client = s3_client
+        return cleaner
+    return make
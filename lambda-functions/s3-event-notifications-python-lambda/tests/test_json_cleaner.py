@@ -0,0 +1,81 @@
+from conftest import BUCKET, gzip_events, read_events
+
+FILE_PATH = 'segment/2024/01/01/events.gz'
+EVENTS = [
+    {'type': 'track', 'context': {'ip': '10.0.0.1'}, 'properties': {'name': 'home'}},
+    {'type': 'page', 'properties': {'account_id': '42', 'path': '/'}},
+]
+
+
+def put_raw_file(s3_client, events: list = EVENTS) -> str:
+    return s3_client.put(BUCKET, FILE_PATH, gzip_events(events))['ETag']
+
+
+def test_process_file_redacts_and_deletes_the_raw_file(s3_client, make_cleaner):
+    etag = put_raw_file(s3_client)
+    cleaner = make_cleaner(streaming=True)
+
+    cleaner.process_file(BUCKET, FILE_PATH, etag)
+
+    processed = s3_client.objects[(BUCKET, cleaner.get_destination_path(FILE_PATH))]
+    events = read_events(processed['Body'])
+    assert events[0]['context']['ip'] is None
+    assert events[1]['properties']['account_id'] is None
+    assert events[1]['properties']['path'] == '/'
+    assert (BUCKET, FILE_PATH) not in s3_client.objects
+    assert cleaner.is_processed(BUCKET, FILE_PATH, etag) == (True, etag)
+
+
+def test_is_processed_with_same_etag_and_settings(s3_client, make_cleaner):
+    etag = put_raw_file(s3_client)
+    make_cleaner().write_file(BUCKET, FILE_PATH, [], etag=etag)
+
+    assert make_cleaner().is_processed(BUCKET, FILE_PATH, etag) == (True, etag)
+    assert make_cleaner().is_processed(BUCKET, FILE_PATH) == (True, etag)
+
+
+def test_is_processed_with_another_etag(s3_client, make_cleaner):
+    etag = put_raw_file(s3_client)
+    make_cleaner().write_file(BUCKET, FILE_PATH, [], etag=etag)
+    new_etag = put_raw_file(s3_client, EVENTS[:1])
+
+    assert make_cleaner().is_processed(BUCKET, FILE_PATH, new_etag) == (False, new_etag)
+    assert make_cleaner().is_processed(BUCKET, FILE_PATH) == (False, new_etag)
+
+
+def test_is_processed_with_other_settings(s3_client, make_cleaner):
+    etag = put_raw_file(s3_client)
+    make_cleaner().write_file(BUCKET, FILE_PATH, [], etag=etag)
+
+    assert make_cleaner(pii_keys=['ip']).is_processed(BUCKET, FILE_PATH, etag) == (False, etag)
+
+
+def test_is_processed_without_processed_file(s3_client, make_cleaner):
+    etag = put_raw_file(s3_client)
+
+    assert make_cleaner().is_processed(BUCKET, FILE_PATH, etag) == (False, etag)
+    assert make_cleaner().is_processed(BUCKET, FILE_PATH) == (False, None)
+
+
+def test_process_file_skips_and_deletes_a_raw_file_already_processed(s3_client, make_cleaner):
+    etag = put_raw_file(s3_client)
+    cleaner = make_cleaner()
+    # A run stopped between the write of the processed file and the deletion of the raw file
+    cleaner.write_file(BUCKET, FILE_PATH, [], etag=etag)
+
+    cleaner.process_file(BUCKET, FILE_PATH, etag)
+
+    assert (BUCKET, FILE_PATH) not in s3_client.objects
+    assert read_events(s3_client.objects[(BUCKET, cleaner.get_destination_path(FILE_PATH))]['Body']) == []
+
+
+def test_process_file_keeps_a_raw_file_uploaded_again(s3_client, make_cleaner):
+    etag = put_raw_file(s3_client)
+    cleaner = make_cleaner()
+    cleaner.write_file(BUCKET, FILE_PATH, [], etag=etag)
+    new_etag = put_raw_file(s3_client, EVENTS[:1])
+
+    # The event of the first upload, received after the second one
+    cleaner.process_file(BUCKET, FILE_PATH, etag)
+
+    assert s3_client.objects[(BUCKET, FILE_PATH)]['ETag'] == new_etag
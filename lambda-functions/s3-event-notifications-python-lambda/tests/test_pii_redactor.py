@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+
+TESTS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', 'lambda'))
+sys.path.insert(0, os.path.join(TESTS_PATH, '..', '..', 'shared'))
+
+import lambda_function  # noqa: E402
+
+
+def test_redact_line_without_pii_key_is_unchanged():
+    redactor = lambda_function.PIIRedactor()
+    line = b'{"type":"track","event":"Viewed","properties":{"name":"home"}}'
+
+    assert redactor.redact_line(line) is line
+
+
+def test_redact_line_replaces_pii_values():
+    redactor = lambda_function.PIIRedactor()
+    line = b'{"type":"track","context":{"ip":"10.0.0.1"},"properties":{"accountId":"42","name":"home"}}'
+
+    event = json.loads(redactor.redact_line(line))
+
+    assert event['context']['ip'] is None
+    assert event['properties']['accountId'] is None
+    assert event['properties']['name'] == 'home'
+
+
+def test_redact_line_replaces_escaped_pii_keys():
+    redactor = lambda_function.PIIRedactor()
+    # The bytes of the keys don't match the PII patterns, their decoded names do
+    line = b'{"type":"track","context":{"\\u0069p":"10.0.0.1"},"properties":{"\\u0061ccount_id":"42"}}'
+
+    event = json.loads(redactor.redact_line(line))
+
+    assert event['context']['ip'] is None
+    assert event['properties']['account_id'] is None
+
+
+def test_redact_line_with_brackets_in_strings_reuses_the_plan():
+    redactor = lambda_function.PIIRedactor()
+    walks = list()
+    walk = redactor.walk
+    redactor.walk = lambda event, learn=True: walks.append(learn) or walk(event, learn)
+    lines = [
+        b'{"type":"track","event":"Searched","context":{"ip":"10.0.0.%d"},"properties":{"query":"[{%d}]"}}' % (i, i)
+        for i in range(3)
+    ]
+
+    events = [json.loads(redactor.redact_line(line)) for line in lines]
+
+    assert walks == [True]
+    assert [event['context']['ip'] for event in events] == [None, None, None]
+    assert [event['properties']['query'] for event in events] == ['[{0}]', '[{1}]', '[{2}]']
+
+
+def test_redact_line_with_brackets_in_strings_and_another_shape():
+    redactor = lambda_function.PIIRedactor()
+    redactor.redact_line(b'{"type":"track","event":"Searched","context":{"ip":"10.0.0.1"},"properties":{"query":"[]"}}')
+    # The query is an object this time, bracket count and plan nodes differing as in the line above
+    line = b'{"type":"track","event":"Searched","context":{"ip":"10.0.0.2"},"properties":{"query":{"ip":"10.0.0.3"}}}'
+
+    event = json.loads(redactor.redact_line(line))
+
+    assert event['context']['ip'] is None
+    assert event['properties']['query']['ip'] is None
@@ -0,0 +1,50 @@
+import json
+import os
+import signal
+
+import lambda_function
+
+CHUNKS = [
+    b'{"type":"track","context":{"ip":"10.0.0.%d"},"properties":{"name":"home"}}\n' % index * 3
+    for index in range(10)
+]
+
+
+def redact_in_process(chunks: list) -> list:
+    redactor = lambda_function.PIIRedactor()
+    return [lambda_function.redact_chunk(redactor, chunk) for chunk in chunks]
+
+
+def test_map_redacts_the_chunks_in_order():
+    with lambda_function.RedactionPool(lambda_function.PII_FIELDS, 'json', 2) as pool:
+        results = list(pool.map(CHUNKS))
+
+    assert results == redact_in_process(CHUNKS)
+    assert json.loads(b'[' + results[0] + b']')[0]['context']['ip'] is None
+
+
+def test_map_redacts_in_process_once_a_worker_died():
+    def chunks_killing_a_worker(pool):
+        for index, chunk in enumerate(CHUNKS):
+            if index == 3:
+                os.kill(pool.processes[0].pid, signal.SIGKILL)
+                pool.processes[0].join()
+            yield chunk
+
+    with lambda_function.RedactionPool(lambda_function.PII_FIELDS, 'json', 2) as pool:
+        results = list(pool.map(chunks_killing_a_worker(pool)))
+
+        assert pool.broken
+        assert not any(process.is_alive() for process in pool.processes)
+        assert results == redact_in_process(CHUNKS)
+        assert list(pool.map(CHUNKS[:2])) == redact_in_process(CHUNKS[:2])
+
+
+def test_map_closed_midway_leaves_the_pool_usable():
+    with lambda_function.RedactionPool(lambda_function.PII_FIELDS, 'json', 2) as pool:
+        results = pool.map(CHUNKS)
+        next(results)
+        results.close()
+
+        assert list(pool.map(CHUNKS[:3])) == redact_in_process(CHUNKS[:3])
+        assert not pool.broken
@@ -34,6 +34,76 @@ variable "concurrent_executions" {
   type        = number
   default     = 5
 }
+variable "streaming" {
+  description = "Whether the Lambda function processes the files line by line instead of in memory"
+  type        = string
+  default     = "true"
+}
+variable "compression_level" {
+  description = "The gzip compression level of the processed files, from 1 (fastest) to 9 (smallest)"
+  type        = string
+  default     = "6"
+}
+variable "download_part_size" {
+  description = "The size in bytes of the byte ranges requested when downloading a file"
+  type        = string
+  default     = "8388608"
+}
+variable "download_concurrency" {
+  description = "The number of byte ranges of a file downloaded concurrently"
+  type        = string
+  default     = "4"
+}
+variable "output_format" {
+  description = "The format of the processed files, either json or parquet"
+  type        = string
+  default     = "json"
+}
+variable "dry_run" {
+  description = "Whether to only audit the raw files for PIIs, logging their PII counts per key path without rewriting them"
+  type        = string
+  default     = "false"
+}
+variable "process_pool" {
+  description = "Whether to redact the large files on every vCPU with a pool of processes, from 3538 MB of memory"
+  type        = string
+  default     = "false"
+}
+variable "json_backend" {
+  description = "The library parsing and serializing the events: json, orjson, or auto to use orjson when a layer provides it"
+  type        = string
+  default     = "auto"
+}
+variable "sqs_batching" {
+  description = "Whether the S3 event notifications are sent to a SQS queue invoking the Lambda function with batches of notifications"
+  type        = bool
+  default     = false
+}
+variable "sqs_batch_size" {
+  description = "The maximum number of S3 event notifications processed per invocation with SQS batching"
+  type        = number
+  default     = 100
+}
+variable "sqs_batching_window" {
+  description = "The maximum time in seconds spent gathering S3 event notifications before invoking the Lambda function with SQS batching"
+  type        = number
+  default     = 30
+}
+variable "sqs_max_receive_count" {
+  description = "The number of failed processings of a S3 event notification before it is moved to the dead-letter queue"
+  type        = number
+  default     = 5
+}
+variable "profile_imports" {
+  description = "Whether to log the duration of the slowest imports on the cold starts"
+  type        = string
+  default     = "false"
+}
+variable "layers" {
+  description = "The ARNs of the Lambda layers, e.g. the AWS SDK for pandas layer providing pyarrow for the parquet output format or a layer providing orjson"
+  type        = list(string)
+  default     = []
+}
 variable "desktop_bucket_id" {
   description = "The ID of the bucket where the desktop logs are written"
   type        = string
@@ -0,0 +1,263 @@
+import builtins
+import collections
+import importlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import types
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Imported first by the handlers, so that the initialization is timed from here
+INIT_START = time.perf_counter()
+# Tuned for the short-lived Lambda invocations: the connections are kept alive between
+# the warm invocations, and the throttled requests are retried with backoff
+CLIENT_CONFIG = {
+    'max_pool_connections': 10,
+    'tcp_keepalive': True,
+    'connect_timeout': 5,
+    'read_timeout': 60,
+    'retries': {'mode': 'standard', 'max_attempts': 5}
+}
+PROFILED_IMPORTS = 10
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+
+class ImportProfiler():
+    """Time the imports of a Lambda function, to break down the cost of its cold starts.
+
+    The builtin __import__ is wrapped until the profiler is stopped, and the time of
+    the nested imports is counted in the outermost import statement, e.g. the import
+    of pandas in the one of redshift_connector. Run Python with PYTHONPROFILEIMPORTTIME=1
+    for the full tree of the imports.
+    """
+    def __init__(self):
+        self.timings = collections.defaultdict(float)
+        self.modules = 0
+        self.depth = 0
+        self.original_import = None
+
+    def start(self) -> 'ImportProfiler':
+        """Start timing the imports."""
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.profile_import
+        return self
+
+    def stop(self) -> None:
+        """Stop timing the imports, the warm invocations running without overhead."""
+        if builtins.__import__ == self.profile_import:
+            builtins.__import__ = self.original_import
+
+    def profile_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        """Import a module like the builtin __import__, timing the modules it loads."""
+        loaded = len(sys.modules)
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            self.depth -= 1
+            if self.depth == 0 and len(sys.modules) > loaded:
+                package = (globals or {}).get('__package__')
+                if level > 0 and package:
+                    name = importlib.util.resolve_name('.' * level + name, package)
+                self.timings[name] += time.perf_counter() - start
+                self.modules += len(sys.modules) - loaded
+
+    def report(self, top: int = PROFILED_IMPORTS) -> dict:
+        """Return the slowest imports, with their duration in milliseconds."""
+        timings = sorted(self.timings.items(), key=lambda timing: timing[1], reverse=True)
+        return {
+            'imports_ms': round(sum(self.timings.values()) * 1000, 1),
+            'modules': self.modules,
+            'slowest_imports': [{'module': name, 'ms': round(seconds * 1000, 1)} for name, seconds in timings[:top]]
+        }
+
+
+import_profiler = ImportProfiler().start() if os.environ.get('profile_imports', 'false') == 'true' else None
+cold_start = True
+clients = dict()
+clients_lock = threading.Lock()
+
+
+def log_cold_start() -> bool:
+    """Log the duration of the initialization on the first invocation of an execution environment.
+
+    The imports are also broken down when the profile_imports environment variable
+    is set to true.
+
+    Returns:
+        Whether the invocation is the first one of its execution environment.
+    """
+    global cold_start
+    if not cold_start:
+        return False
+    cold_start = False
+
+    record = {'init_ms': round((time.perf_counter() - INIT_START) * 1000, 1)}
+    if import_profiler is not None:
+        import_profiler.stop()
+        record.update(import_profiler.report())
+    logger.info(f'Cold start: {json.dumps(record)}')
+    return True
+
+
+def get_client(service_name: str, region_name: str = None, **config):
+    """Return a boto3 client shared by the invocations of the execution environment.
+
+    Creating a client loads its service model and opens new connections, which
+    takes tens of milliseconds per invocation. The clients are thread-safe, so a
+    single one is cached per service, region and configuration.
+
+    Args:
+        service_name: The name of the AWS service, e.g. 's3'.
+        region_name: The AWS region of the service. Defaults to None, the region of the function.
+        **config: The botocore configuration settings overriding CLIENT_CONFIG.
+
+    Returns:
+        The boto3 client.
+    """
+    settings = json.dumps({**CLIENT_CONFIG, **config}, sort_keys=True)
+    key = (service_name, region_name, settings)
+    with clients_lock:
+        client = clients.get(key)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+
+            # botocore rewrites the retries settings in place, so it is given a copy
+            client = boto3.client(service_name, region_name=region_name, config=Config(**json.loads(settings)))
+            clients[key] = client
+    return client
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """Writable file object uploading its content to S3 as a multipart upload.
+
+    The content is buffered until a part is complete, so that the memory used
+    does not depend on the size of the uploaded object. The upload is completed
+    on close and aborted when an exception is raised in its context.
+    """
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        file_path: str,
+        part_size: int = MULTIPART_CHUNKSIZE,
+        metadata: dict = None,
+    ):
+        """Initiate the multipart upload.
+
+        Args:
+            s3_client: The S3 client used for the upload.
+            bucket: The S3 bucket where to write the file.
+            file_path: The path of the file to be written in S3.
+            part_size: The size in bytes of the uploaded parts. Defaults to MULTIPART_CHUNKSIZE.
+            metadata: The user metadata of the file. Defaults to None.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.file_path = file_path
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = list()
+        upload = self.s3_client.create_multipart_upload(Bucket=bucket, Key=file_path, Metadata=metadata or {})
+        self.upload_id = upload['UploadId']
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        """Buffer the data and upload every complete part."""
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self.upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def upload_part(self, data: bytes) -> None:
+        """Upload the next part of the file."""
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.file_path,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number, 'Size': len(data)})
+
+    def close(self) -> None:
+        """Upload the remaining data and complete the multipart upload."""
+        if self.closed:
+            return
+        if self.buffer or not self.parts:
+            self.upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.file_path,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': [{'ETag': part['ETag'], 'PartNumber': part['PartNumber']} for part in self.parts]}
+        )
+        super().close()
+
+    def abort(self) -> None:
+        """Abort the multipart upload and discard the uploaded parts."""
+        if self.closed:
+            return
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.file_path, UploadId=self.upload_id)
+        self.buffer = bytearray()
+        super().close()
+
+    def __exit__(self, exception_type, exception_value, exception_traceback) -> None:
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class LazyModule(types.ModuleType):
+    """Module imported on the first access to one of its attributes."""
+    def __init__(self, name: str, submodules: tuple = ()):
+        super().__init__(name)
+        self.__submodules = submodules
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, attribute: str):
+        with self.__lock:
+            module = importlib.import_module(self.__name__)
+            for submodule in self.__submodules:
+                importlib.import_module(f'{self.__name__}.{submodule}')
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+def lazy_import(name: str, *submodules: str):
+    """Return a module imported only when one of its attributes is first used.
+
+    The heavy dependencies used on some code paths only, e.g. pyarrow for the
+    Parquet output or redshift_connector and pandas, are then not imported on
+    the cold starts of the invocations that do not need them.
+
+    Args:
+        name: The name of the module, e.g. 'pyarrow'.
+        *submodules: The submodules to import along with the module, e.g. 'parquet'.
+
+    Returns:
+        The lazily imported module, or None when it is not installed.
+    """
+    if name in sys.modules:
+        module = sys.modules[name]
+        for submodule in submodules:
+            importlib.import_module(f'{name}.{submodule}')
+        return module
+    if importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name, submodules)